@@ -0,0 +1,528 @@
+# fb_checker.py
+"""
+Thư viện check LIVE/DIE dùng chung cho cả 2 bot (tele_fb_monitor.py, tele_fb_monitor1.py)
+và poller. Có bản sync, async và batch (check_many) trả kết quả theo thứ tự xong trước.
+"""
+import os, re, html, time, asyncio, threading, logging
+from collections import namedtuple, Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse, parse_qs
+
+import requests
+from bs4 import BeautifulSoup
+from dotenv import load_dotenv
+
+LOGGER = logging.getLogger("FBWatchBot.checker")
+
+# ===================== CONFIG =====================
+load_dotenv()
+
+# Egress proxy pool: "http://u:p@host:port,socks5://host:port#4" (#N = số probe đồng thời
+# của proxy đó). Để trống -> đi thẳng từ IP của dyno như trước.
+PROXIES = [p for p in re.split(r"[,\s]+", os.getenv("PROXIES", "")) if p]
+PROXY_MAX_CONCURRENCY = int(os.getenv("PROXY_MAX_CONCURRENCY", "2"))
+PROXY_QUARANTINE_SEC = int(os.getenv("PROXY_QUARANTINE_SEC", "300"))
+PROBE_INTERVAL_SEC = float(os.getenv("PROBE_INTERVAL_SEC", "0.6"))  # giãn cách probe trên mỗi egress
+PROBE_BODY_LIMIT = int(os.getenv("PROBE_BODY_LIMIT", "32768"))      # byte tối đa probe nhẹ đọc
+
+HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+    ),
+    "Accept-Language": "vi-VN,vi;q=0.9,en-US;q=0.8,en;q=0.7",
+}
+
+# Chỉ coi những cụm này là DIE (login wall/private KHÔNG coi là DIE)
+DEAD_PHRASES = [
+    "this content isn't available right now",
+    "this page isn't available",
+    "the link may be broken",
+    "content isn't available",
+    "page not found",
+    "the page you requested cannot be displayed right now",
+    "trang bạn yêu cầu không thể hiển thị",
+    "liên kết có thể đã bị hỏng",
+    "bạn hiện không thể xem nội dung này",
+    "nội dung này hiện không khả dụng",
+    "rất tiếc, nội dung này hiện không khả dụng",
+]
+
+UID_RE = re.compile(r"^\d{5,}$")
+
+CheckResult = namedtuple("CheckResult", "status name variant")
+
+# set khi shutdown: probe không thử thêm endpoint/egress nào nữa, trả kết quả mơ hồ
+STOP_EVENT = threading.Event()
+
+# kết quả confirm_status
+CONFIRMED, CONTRADICTED, INCONCLUSIVE = "confirmed", "contradicted", "inconclusive"
+
+
+# ===================== EGRESS PROXY POOL =====================
+class EgressProxy:
+    """1 đường ra (proxy hoặc direct) với giới hạn đồng thời và điểm sức khỏe."""
+
+    def __init__(self, url: str | None, max_concurrency: int):
+        self.url = url
+        self.max_concurrency = max(1, max_concurrency)
+        self.in_flight = 0
+        self.next_at = 0.0              # monotonic, giãn cách `pace` giây giữa 2 probe
+        self.pace = PROBE_INTERVAL_SEC  # tăng khi egress không được phép quarantine mà bị 429
+        self.success_rate = 1.0         # EWMA
+        self.throttle_rate = 0.0        # EWMA
+        self.latency = 1.0              # EWMA (giây)
+        self.samples = 0
+        self.strikes = 0
+        self.quarantined_until = 0.0
+
+    @property
+    def proxies(self):
+        return {"http": self.url, "https": self.url} if self.url else None
+
+    def score(self) -> float:
+        return self.success_rate * (1.0 - self.throttle_rate) / (1.0 + self.latency)
+
+    @property
+    def label(self) -> str:
+        """URL để log: bỏ user:pass@ của proxy."""
+        if not self.url:
+            return "direct"
+        u = urlparse(self.url)
+        if u.username or u.password:
+            return u._replace(netloc="***@" + u.netloc.rpartition("@")[2]).geturl()
+        return self.url
+
+    def __repr__(self):
+        return (f"<Egress {self.label} score={self.score():.2f} "
+                f"ok={self.success_rate:.2f} 429={self.throttle_rate:.2f} lat={self.latency:.2f}s "
+                f"inflight={self.in_flight}/{self.max_concurrency}"
+                f"{' Q' if self.quarantined_until > time.monotonic() else ''}>")
+
+
+class ProxyPool:
+    ALPHA = 0.2          # trọng số EWMA
+    MIN_SAMPLES = 5      # số mẫu tối thiểu trước khi xét quarantine vì lỗi
+    MAX_PACE_SEC = 10.0  # giãn cách tối đa khi hãm tốc thay cho quarantine (< timeout của probe)
+
+    def __init__(self, urls: list[str], max_concurrency: int):
+        self.members = []
+        for raw in urls:
+            url, _, n = raw.rpartition("#")
+            if not (url and n.isdigit()):
+                url, n = raw, ""
+            self.members.append(EgressProxy(url, int(n) if n else max_concurrency))
+        if not self.members:
+            self.members.append(EgressProxy(None, 1))
+        self.cond = threading.Condition()
+
+    @property
+    def capacity(self) -> int:
+        return sum(m.max_concurrency for m in self.members)
+
+    def acquire(self, timeout: float | None = None, avoid=()) -> EgressProxy | None:
+        """
+        Lấy egress có điểm tốt nhất còn slot; None nếu hết timeout.
+        avoid: egress vừa lỗi với probe này -> chờ egress khác (trừ khi không còn egress nào khác).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while True:
+                if STOP_EVENT.is_set():
+                    return None
+                now = time.monotonic()
+                others = any(m not in avoid for m in self.members)
+                ready = [m for m in self.members
+                         if m.in_flight < m.max_concurrency
+                         and m.quarantined_until <= now and m.next_at <= now
+                         and not (others and m in avoid)]
+                if ready:
+                    best = max(ready, key=lambda m: m.score() * (1.0 - m.in_flight / m.max_concurrency))
+                    best.in_flight += 1
+                    best.next_at = now + best.pace
+                    return best
+                wake = [t for m in self.members for t in (m.quarantined_until, m.next_at) if t > now]
+                wait = min(min(wake) - now if wake else 1.0, 1.0)  # thức dậy xem STOP_EVENT
+                if deadline is not None:
+                    if now >= deadline:
+                        return None
+                    wait = min(wait, deadline - now)
+                self.cond.wait(timeout=max(0.01, wait))
+
+    def release(self, member: EgressProxy, outcome: str, latency: float):
+        """outcome: 'ok' | 'error' | 'throttled'."""
+        a = self.ALPHA
+        with self.cond:
+            member.in_flight -= 1
+            member.samples += 1
+            member.success_rate = (1 - a) * member.success_rate + a * (outcome == "ok")
+            member.throttle_rate = (1 - a) * member.throttle_rate + a * (outcome == "throttled")
+            if outcome != "error":
+                member.latency = (1 - a) * member.latency + a * latency
+
+            now = time.monotonic()
+            sick = member.samples >= self.MIN_SAMPLES and member.success_rate < 0.5
+            already = member.quarantined_until > now
+            # direct egress / egress khỏe cuối cùng không bao giờ bị quarantine (pool sẽ
+            # đứng hẳn, mọi probe thành "không rõ") -> chỉ giãn nhịp probe của nó
+            last_one = member.url is None or not any(
+                m is not member and m.quarantined_until <= now for m in self.members)
+            if outcome == "throttled" and last_one:
+                member.pace = min(max(member.pace, PROBE_INTERVAL_SEC, 0.5) * 2, self.MAX_PACE_SEC)
+                member.next_at = max(member.next_at, now + member.pace)
+                LOGGER.warning("Throttled on last egress, slowing to 1 probe/%.1fs: %r", member.pace, member)
+            elif (outcome == "throttled" or sick) and not already and not last_one:
+                # backoff lũy tiến; hết hạn thì cho chạy lại với điểm "thử việc"
+                member.quarantined_until = now + PROXY_QUARANTINE_SEC * 2 ** min(member.strikes, 4)
+                member.strikes += 1
+                member.success_rate = max(member.success_rate, 0.6)
+                member.throttle_rate = 0.0
+                member.samples = 0
+                LOGGER.warning("Quarantined egress %r", member)
+            elif outcome == "ok":
+                member.pace = max(PROBE_INTERVAL_SEC, member.pace / 2)
+                if member.success_rate > 0.9 and not already:
+                    member.strikes = 0
+            self.cond.notify_all()
+
+    def snapshot(self):
+        with self.cond:
+            return [repr(m) for m in self.members]
+
+
+PROXY_POOL = ProxyPool(PROXIES, PROXY_MAX_CONCURRENCY)
+
+
+# ===================== FB STATUS DETECTION =====================
+def normalize_target(s: str):
+    s = s.strip()
+    if s.startswith("http"):
+        u = urlparse(s)
+        if "facebook.com" not in u.netloc:
+            raise ValueError("Đây không phải link Facebook hợp lệ.")
+        qs = parse_qs(u.query)
+        if "id" in qs and qs["id"][0].isdigit():
+            uid = qs["id"][0]
+            url = f"https://mbasic.facebook.com/profile.php?id={uid}"
+            return uid, url
+        slug = u.path.strip("/").split("/")[0]
+        if not slug:
+            raise ValueError("Không lấy được UID/username từ link.")
+        uid = slug
+        url = f"https://mbasic.facebook.com/{slug}"
+        return uid, url
+    else:
+        uid = s
+        if not re.match(r'^[A-Za-z0-9\.]+$', uid):
+            raise ValueError("UID/username không hợp lệ.")
+        if UID_RE.match(uid):
+            url = f"https://mbasic.facebook.com/profile.php?id={uid}"
+        else:
+            url = f"https://mbasic.facebook.com/{uid}"
+        return uid, url
+
+def _generic_title(title: str) -> bool:
+    # title/og:title của login wall, trang lỗi... không phải tên profile
+    low = title.lower()
+    return any(k in low for k in ["facebook", "log in"])
+
+def classify_page(status_code: int, text: str) -> tuple[str|None, str|None]:
+    """Phân loại 1 response đã tải về -> (LIVE|DIE, name). Không I/O, dùng cho cả bench offline."""
+    if status_code in (404, 410):
+        return "DIE", None
+
+    text_lower = text.lower()
+    if any(phrase in text_lower for phrase in DEAD_PHRASES):
+        return "DIE", None
+
+    soup = BeautifulSoup(text, "html.parser")
+    name = None
+    og = soup.find("meta", attrs={"property": "og:title"})
+    if og and og.get("content") and not _generic_title(og["content"]):
+        name = og["content"].strip()
+    if not name and soup.title and soup.title.text:
+        t = soup.title.text.strip()
+        if not _generic_title(t):
+            name = t
+    return "LIVE", name
+
+def _egress_failed(status_code: int) -> bool:
+    """407/5xx: proxy (hoặc FB) lỗi, trang trả về không nói gì về UID."""
+    return status_code == 407 or status_code >= 500
+
+def _try_fetch(url: str, headers: dict, timeout: int, failed: list | None = None) -> tuple[str|None, str|None, str]:
+    """failed: list dùng chung giữa các endpoint của 1 probe, egress lỗi được thêm vào để lần sau tránh."""
+    egress = PROXY_POOL.acquire(timeout=timeout, avoid=failed or ())
+    if egress is None:
+        return None, None, url
+    started, outcome = time.monotonic(), "error"
+    try:
+        r = requests.get(url, headers=headers, timeout=timeout, allow_redirects=True, proxies=egress.proxies)
+        final = r.url.lower()
+
+        if r.status_code == 429:
+            # bị rate limit: không kết luận được gì
+            outcome = "throttled"
+            return None, None, final
+        if _egress_failed(r.status_code):
+            return None, None, final
+        outcome = "ok"
+
+        status, name = classify_page(r.status_code, r.text)
+        return status, name, final
+    except Exception:
+        return None, None, url
+    finally:
+        PROXY_POOL.release(egress, outcome, time.monotonic() - started)
+        if outcome != "ok" and failed is not None:
+            failed.append(egress)
+
+def _probe_variants(url: str):
+    """Các endpoint thay thế cho cùng 1 UID: (url, headers)."""
+    alt = url.replace("mbasic.facebook", "m.facebook") if "mbasic.facebook" in url else url.replace("m.facebook", "mbasic.facebook")
+    crawler_headers = {**HEADERS, "User-Agent": "facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)"}
+    alt2 = alt.replace("m.facebook", "www.facebook").replace("mbasic.facebook", "www.facebook")
+    return [(url, HEADERS), (alt, HEADERS), (alt2, crawler_headers)]
+
+def probe_status(url: str, timeout: int = 20) -> CheckResult:
+    """Như fetch_status_and_name nhưng trả thêm index endpoint đã trả lời."""
+    failed = []
+    for i, (target, headers) in enumerate(_probe_variants(url)):
+        if STOP_EVENT.is_set():
+            break
+        status, name, _ = _try_fetch(target, headers, timeout, failed)
+        if status is not None:
+            return CheckResult(status, name, i)
+    return CheckResult(None, None, None)
+
+def fetch_status_and_name(url: str, timeout: int = 20):
+    status, name, _ = probe_status(url, timeout)
+    return status, name
+
+def confirm_status(url: str, expected: str, skip: int | None = None, timeout: int = 20,
+                   probes: int = 2, delay: float = 2.0):
+    """
+    Probe lại trên các endpoint KHÁC endpoint đã báo đổi trạng thái.
+    Trả (CONFIRMED, name) nếu `probes` probe (tối đa số endpoint còn lại) đều ra `expected`,
+    (CONTRADICTED, None) nếu có probe ra status khác,
+    (INCONCLUSIVE, None) nếu không đủ probe trả lời (lỗi mạng, 429, hết egress).
+    """
+    variants = [v for i, v in enumerate(_probe_variants(url)) if i != skip]
+    needed = min(probes, len(variants))
+    agreed, name, failed = 0, None, []
+    for target, headers in variants:
+        if agreed >= probes:
+            break
+        if agreed and STOP_EVENT.wait(delay):
+            break
+        status, n, _ = _try_fetch(target, headers, timeout, failed)
+        if status is None:
+            continue
+        if status != expected:
+            return CONTRADICTED, None
+        agreed += 1
+        name = name or n
+    return (CONFIRMED, name) if agreed >= needed else (INCONCLUSIVE, None)
+
+
+# ===================== PROBE STRATEGIES =====================
+# Mỗi loại (subscriptions.kind) có 1 strategy chọn endpoint/request rẻ nhất đủ để
+# quyết định status; trả None khi mơ hồ -> probe_kind fallback về full page (probe_status).
+PROBE_STRATEGIES: dict[str, "ProbeStrategy"] = {}
+PROBE_STATS = Counter()   # "<kind>:light|fallback|bytes" -> số đếm, log mỗi chu kỳ
+_STATS_LOCK = threading.Lock()
+
+META_RE = re.compile(r"<meta\b[^>]*>", re.I)
+CONTENT_RE = re.compile(r"""content\s*=\s*["']([^"']*)["']""", re.I)
+
+def register_strategy(kind: str):
+    def _decorator(cls):
+        PROBE_STRATEGIES[kind] = cls()
+        return cls
+    return _decorator
+
+def _bump(**counts):
+    with _STATS_LOCK:
+        PROBE_STATS.update(counts)
+
+def _og_title(text: str) -> str | None:
+    for m in META_RE.finditer(text):
+        tag = m.group(0)
+        if "og:title" in tag:
+            c = CONTENT_RE.search(tag)
+            return html.unescape(c.group(1)).strip() if c and c.group(1).strip() else None
+    return None
+
+def _light_fetch(url: str, headers: dict, timeout: int, limit: int):
+    """
+    GET dạng stream, chỉ đọc tối đa `limit` byte rồi đóng kết nối.
+    Trả (status_code, text, complete, nbytes) hoặc None nếu lỗi/429.
+    """
+    egress = PROXY_POOL.acquire(timeout=timeout)
+    if egress is None:
+        return None
+    started, outcome = time.monotonic(), "error"
+    try:
+        with requests.get(url, headers=headers, timeout=timeout, allow_redirects=True,
+                          proxies=egress.proxies, stream=True) as r:
+            if r.status_code == 429:
+                outcome = "throttled"
+                return None
+            if _egress_failed(r.status_code):
+                return None
+            outcome = "ok"
+            if r.status_code in (404, 410):
+                return r.status_code, "", True, 0
+            buf, complete = bytearray(), True
+            for chunk in r.iter_content(8192):
+                buf += chunk
+                if len(buf) >= limit:
+                    complete = False
+                    break
+            return r.status_code, buf.decode(r.encoding or "utf-8", errors="ignore"), complete, len(buf)
+    except Exception:
+        return None
+    finally:
+        PROXY_POOL.release(egress, outcome, time.monotonic() - started)
+
+class ProbeStrategy:
+    kind = "profile"
+    limit = PROBE_BODY_LIMIT
+
+    def light_url(self, url: str) -> str:
+        return url
+
+    def decide(self, status_code: int, text: str, complete: bool) -> tuple[str|None, str|None]:
+        # đọc hết body trong giới hạn -> phân loại y hệt full page
+        if complete:
+            return classify_page(status_code, text)
+        # body bị cắt: DIE nếu đã thấy cụm chết, LIVE nếu đã thấy og:title mang tên thật;
+        # og:title chung ("Facebook", "Log in ...") có cả trên trang chết -> mơ hồ, tải full page
+        if any(phrase in text.lower() for phrase in DEAD_PHRASES):
+            return "DIE", None
+        name = _og_title(text)
+        return ("LIVE", name) if name and not _generic_title(name) else (None, None)
+
+    def probe(self, url: str, timeout: int = 20) -> CheckResult | None:
+        target = self.light_url(url)
+        got = _light_fetch(target, HEADERS, timeout, self.limit)
+        if got is None:
+            return None
+        status_code, text, complete, nbytes = got
+        _bump(**{f"{self.kind}:bytes": nbytes})
+        status, name = self.decide(status_code, text, complete)
+        if status is None:
+            return None
+        return CheckResult(status, name, 0 if target == url else None)
+
+@register_strategy("profile")
+class ProfileProbe(ProbeStrategy):
+    """mbasic profile: 404/410 quyết định từ header; trang chết/og:title nằm ở vài KB đầu."""
+    kind = "profile"
+
+@register_strategy("group")
+class GroupProbe(ProbeStrategy):
+    """
+    Group: hỏi thẳng /groups/<id> (không qua redirect của profile.php) và chỉ tin kết quả LIVE;
+    DIE ở endpoint này có thể do UID không phải group -> để full page trên URL gốc quyết định.
+    """
+    kind = "group"
+
+    def light_url(self, url: str) -> str:
+        m = re.search(r"profile\.php\?id=(\d+)", url)
+        return f"https://mbasic.facebook.com/groups/{m.group(1)}" if m else url
+
+    def decide(self, status_code, text, complete):
+        status, name = super().decide(status_code, text, complete)
+        return (status, name) if status == "LIVE" else (None, None)
+
+def probe_kind(url: str, kind: str | None, timeout: int = 20) -> CheckResult:
+    """Probe nhẹ theo kind, fallback full page khi mơ hồ."""
+    strategy = PROBE_STRATEGIES.get(kind or "profile", PROBE_STRATEGIES["profile"])
+    res = strategy.probe(url, timeout)
+    if res is not None:
+        _bump(**{f"{strategy.kind}:light": 1})
+        return res
+    if STOP_EVENT.is_set():
+        return CheckResult(None, None, None)
+    _bump(**{f"{strategy.kind}:fallback": 1})
+    return probe_status(url, timeout)
+
+def probe_stats_snapshot(reset: bool = False) -> dict:
+    with _STATS_LOCK:
+        snap = dict(PROBE_STATS)
+        if reset:
+            PROBE_STATS.clear()
+    return snap
+
+
+# ===================== PUBLIC API =====================
+def profile_url(target: str) -> str:
+    return normalize_target(target)[1]
+
+def check(target: str, timeout: int = 20) -> CheckResult:
+    """Check 1 UID/username/URL. Target không hợp lệ -> CheckResult(None, None, None)."""
+    try:
+        url = profile_url(target)
+    except ValueError:
+        return CheckResult(None, None, None)
+    return probe_status(url, timeout)
+
+def check_live(uid: str) -> str:
+    """'live' | 'die' | 'unknown' (API cũ của check_live_sync)."""
+    status = check(uid).status
+    return status.lower() if status else "unknown"
+
+def check_many(items, url_of=None, max_workers: int | None = None, timeout: int = 20, kind_of=None):
+    """
+    Check nhiều UID song song (mặc định = số slot của proxy pool),
+    yield (item, CheckResult) theo thứ tự xong trước.
+    items: UID/username/URL, hoặc object bất kỳ kèm url_of(item) -> url.
+    kind_of(item) -> 'profile'|'group': dùng probe nhẹ theo kind (probe_kind).
+    """
+    items = list(items)
+    if not items:
+        return
+    def _one(item):
+        if not url_of:
+            return check(item, timeout)
+        if kind_of:
+            return probe_kind(url_of(item), kind_of(item), timeout)
+        return probe_status(url_of(item), timeout)
+    workers = min(len(items), max_workers or PROXY_POOL.capacity)
+    ex = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="check")
+    try:
+        futs = {ex.submit(_one, item): item for item in items}
+        for fut in as_completed(futs):
+            try:
+                res = fut.result()
+            except Exception:
+                LOGGER.exception("check failed for %r", futs[fut])
+                res = CheckResult(None, None, None)
+            yield futs[fut], res
+    finally:
+        # caller dừng sớm (break) -> bỏ các probe chưa chạy, chờ probe đang bay
+        ex.shutdown(wait=True, cancel_futures=True)
+
+async def acheck(target: str, timeout: int = 20) -> CheckResult:
+    return await asyncio.to_thread(check, target, timeout)
+
+async def afetch_status_and_name(url: str, timeout: int = 20):
+    return await asyncio.to_thread(fetch_status_and_name, url, timeout)
+
+async def acheck_many(items, url_of=None, max_workers: int | None = None, timeout: int = 20):
+    """Bản async của check_many: `async for item, res in acheck_many(...)`."""
+    q: asyncio.Queue = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+    done = object()
+
+    def _run():
+        try:
+            for pair in check_many(items, url_of, max_workers, timeout):
+                loop.call_soon_threadsafe(q.put_nowait, pair)
+        finally:
+            loop.call_soon_threadsafe(q.put_nowait, done)
+
+    threading.Thread(target=_run, daemon=True).start()
+    while (pair := await q.get()) is not done:
+        yield pair
@@ -1,22 +1,27 @@
 # tele_fb_monitor.py
-import os, re, sqlite3, time, html, threading, logging, traceback
+import os, re, sqlite3, time, html, threading, logging, traceback, queue, asyncio, json, hmac, signal, heapq
+from collections import deque
 from datetime import datetime, timezone
 from urllib.parse import urlparse, parse_qs
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-import requests
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 
 from apscheduler.schedulers.background import BackgroundScheduler
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
-from telegram.error import Conflict
+from telegram.error import BadRequest, Conflict, Forbidden, NetworkError, RetryAfter
 from telegram.ext import (
     Application, CommandHandler, ContextTypes, CallbackQueryHandler,
     ConversationHandler, MessageHandler, filters
 )
 
+from fb_checker import (
+    PROXY_POOL, normalize_target, confirm_status, check_many, probe_stats_snapshot,
+    CONFIRMED, CONTRADICTED, STOP_EVENT,
+    acheck_many, afetch_status_and_name,
+)
+
 # ===================== LOGGING =====================
 LOGGER = logging.getLogger("FBWatchBot")
 logging.basicConfig(
@@ -28,8 +33,44 @@ logging.basicConfig(
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-DB_PATH = "fbwatch.db"
+DB_PATH = os.getenv("DB_PATH", "fbwatch.db")
 CHECK_INTERVAL_SEC = 300  # chu kỳ check định kỳ
+CONFIRM_PROBES = int(os.getenv("CONFIRM_PROBES", "2"))          # số probe xác nhận khi nghi đổi trạng thái
+CONFIRM_DELAY_SEC = float(os.getenv("CONFIRM_DELAY_SEC", "2"))  # nghỉ giữa các probe xác nhận
+CONFIRM_WORKERS = int(os.getenv("CONFIRM_WORKERS", "2"))
+
+# Webhook mode: đặt WEBHOOK_URL (vd https://bot.example.com/telegram) để nhận update
+# qua HTTP trên cùng PORT với health server thay vì long polling.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_PATH = (urlparse(WEBHOOK_URL).path or "/telegram") if WEBHOOK_URL else None
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "1"))  # số update xử lý đồng thời
+
+# Nhiều replica webhook chỉ đúng khi:
+#  - mọi replica dùng CHUNG 1 DB_PATH (cùng máy/volume; SQLite không chia sẻ được qua mạng),
+#    nếu không subscription thêm ở replica này sẽ vô hình với replica khác;
+#  - đúng 1 replica (leader) chạy BACKGROUND_WORKERS=1 (poller, làn xác nhận, dọn orphan,
+#    feed /changes /events); các replica còn lại đặt 0, nếu không mỗi thay đổi bị báo N lần;
+#  - /them nhiều bước giữ state trong RAM của từng replica: update của Telegram không
+#    sticky được, nên dùng dạng 1 dòng "/them <uid> | ghi chú | khách".
+BACKGROUND_WORKERS = os.getenv("BACKGROUND_WORKERS", "1") != "0"
+
+POLL_CHUNK_SIZE = int(os.getenv("POLL_CHUNK_SIZE", "500"))  # số profile đọc từ DB mỗi lần
+DRAIN_TIMEOUT_SEC = int(os.getenv("DRAIN_TIMEOUT_SEC", "20"))  # Heroku cho 30s sau SIGTERM
+
+# Change feed (/changes JSON, /events SSE) trên cùng PORT; tắt nếu không đặt FEED_TOKEN
+FEED_TOKEN = os.getenv("FEED_TOKEN")
+FEED_BUFFER = max(0, int(os.getenv("FEED_BUFFER", "10000")))  # số sự kiện giữ trong RAM (0 = luôn đọc SQLite)
+FEED_RETENTION = int(os.getenv("FEED_RETENTION", "100000"))  # số sự kiện giữ trong change_events (0 = không cắt)
+
+# Quota mặc định khi chưa set riêng bằng /setquota (0 = không giới hạn)
+DEFAULT_CHAT_QUOTA = int(os.getenv("DEFAULT_CHAT_QUOTA", "0"))
+DEFAULT_CUSTOMER_QUOTA = int(os.getenv("DEFAULT_CUSTOMER_QUOTA", "0"))
+FAIR_BATCH = int(os.getenv("FAIR_BATCH", "50"))  # số UID lấy mỗi lượt của 1 tenant
+ALERT_MAX_RETRIES = int(os.getenv("ALERT_MAX_RETRIES", "5"))  # số lần thử lại khi 429 / lỗi mạng
+ALERT_CONCURRENCY = int(os.getenv("ALERT_CONCURRENCY", "16"))  # alert gửi đồng thời (< pool 256 kết nối của PTB)
+ALERT_RATE = float(os.getenv("ALERT_RATE", "25"))              # tin/s toàn bot (Telegram giới hạn ~30)
+ORPHAN_SWEEP_SEC = int(os.getenv("ORPHAN_SWEEP_SEC", "3600"))  # chu kỳ dọn profile không còn ai theo dõi
 
 def _parse_ids(s: str | None):
     if not s:
@@ -43,32 +84,8 @@ def _parse_ids(s: str | None):
 OWNER_IDS_SEED = _parse_ids(os.getenv("OWNER_IDS"))  # "111,222"
 USER_IDS_SEED  = _parse_ids(os.getenv("USER_IDS"))   # "333 444"
 
-HEADERS = {
-    "User-Agent": (
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-        "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
-    ),
-    "Accept-Language": "vi-VN,vi;q=0.9,en-US;q=0.8,en;q=0.7",
-}
-
-# Chỉ coi những cụm này là DIE (login wall/private KHÔNG coi là DIE)
-DEAD_PHRASES = [
-    "this content isn't available right now",
-    "this page isn't available",
-    "the link may be broken",
-    "content isn't available",
-    "page not found",
-    "the page you requested cannot be displayed right now",
-    "trang bạn yêu cầu không thể hiển thị",
-    "liên kết có thể đã bị hỏng",
-    "bạn hiện không thể xem nội dung này",
-    "nội dung này hiện không khả dụng",
-    "rất tiếc, nội dung này hiện không khả dụng",
-]
-
 # Conversation states
 ADD_UID, ADD_TYPE, ADD_NOTE, ADD_CUSTOMER = range(1, 5)
-UID_RE = re.compile(r"^\d{5,}$")
 
 
 # ===================== DB & AUTH =====================
@@ -80,6 +97,7 @@ def db():
     conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
     conn.execute("PRAGMA journal_mode=WAL;")
     conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA foreign_keys=ON;")
 
     conn.execute("""
     CREATE TABLE IF NOT EXISTS allowed(
@@ -106,6 +124,66 @@ def db():
         FOREIGN KEY(uid) REFERENCES profiles(uid) ON DELETE CASCADE
     )
     """)
+    # checkpoint của poller: con trỏ chu kỳ + các thay đổi đang chờ xác nhận
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS poll_state(
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS pending_checks(
+        uid TEXT PRIMARY KEY,
+        url TEXT NOT NULL,
+        prev TEXT,
+        status TEXT NOT NULL,
+        variant INTEGER,
+        queued_at TEXT
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS change_events(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        uid TEXT NOT NULL,
+        url TEXT,
+        name TEXT,
+        old TEXT,
+        new TEXT NOT NULL,
+        at TEXT NOT NULL
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS quotas(
+        scope TEXT CHECK(scope IN ('chat','customer')) NOT NULL,
+        key TEXT NOT NULL,
+        max_uids INTEGER,
+        weight REAL NOT NULL DEFAULT 1,
+        PRIMARY KEY(scope, key)
+    )
+    """)
+    # alert đã quyết định gửi nhưng chưa giao xong: xóa khi Telegram nhận, còn lại gửi lại lúc start
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS alert_outbox(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        uid TEXT NOT NULL,
+        url TEXT NOT NULL,
+        text TEXT NOT NULL,
+        queued_at TEXT NOT NULL
+    )
+    """)
+    # profile bị dọn khi không còn subscription (giữ lại name/status để tra cứu)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS profiles_archive(
+        uid TEXT PRIMARY KEY,
+        url TEXT NOT NULL,
+        name TEXT,
+        last_status TEXT,
+        archived_at TEXT NOT NULL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_subs_customer ON subscriptions(customer)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_subs_uid ON subscriptions(uid)")
     # migrations (an toàn)
     try:
         cols = [r[1] for r in conn.execute("PRAGMA table_info(subscriptions)").fetchall()]
@@ -117,6 +195,12 @@ def db():
             conn.execute("ALTER TABLE subscriptions ADD COLUMN kind TEXT")
     except Exception:
         pass
+    try:
+        cols = [r[1] for r in conn.execute("PRAGMA table_info(profiles)").fetchall()]
+        if "last_checked" not in cols:
+            conn.execute("ALTER TABLE profiles ADD COLUMN last_checked INTEGER")
+    except Exception:
+        pass
     return conn
 
 def seed_allowed_from_env():
@@ -154,27 +238,80 @@ def revoke_user(user_id: int):
 
 
 # ===================== WATCH DB HELPERS =====================
-def add_subscription(chat_id:int, uid:str, url:str, note:str|None=None, customer:str|None=None, kind:str|None="profile"):
+class QuotaExceeded(ValueError):
+    pass
+
+def get_quota(scope: str, key) -> tuple[int, float]:
+    """(max_uids, weight) của chat/customer; max 0 = không giới hạn."""
+    con = db()
+    row = con.execute("SELECT max_uids, weight FROM quotas WHERE scope=? AND key=?", (scope, str(key))).fetchone()
+    con.close()
+    default = DEFAULT_CHAT_QUOTA if scope == "chat" else DEFAULT_CUSTOMER_QUOTA
+    if not row:
+        return default, 1.0
+    return (default if row[0] is None else row[0]), row[1]
+
+def set_quota(scope: str, key, max_uids: int | None, weight: float | None = None):
     con = db()
-    con.execute("INSERT OR IGNORE INTO profiles(uid,url) VALUES(?,?)", (uid,url))
-    con.execute("""
-        INSERT OR IGNORE INTO subscriptions(chat_id,uid,note,customer,kind)
-        VALUES(?,?,?,?,?)
-    """, (chat_id, uid, note, customer, kind))
-    if note is not None:
-        con.execute("UPDATE subscriptions SET note=? WHERE chat_id=? AND uid=?", (note, chat_id, uid))
-    if customer is not None:
-        con.execute("UPDATE subscriptions SET customer=? WHERE chat_id=? AND uid=?", (customer, chat_id, uid))
-    if kind is not None:
-        con.execute("UPDATE subscriptions SET kind=? WHERE chat_id=? AND uid=?", (kind, chat_id, uid))
+    con.execute("INSERT OR IGNORE INTO quotas(scope, key) VALUES(?, ?)", (scope, str(key)))
+    if max_uids is not None:
+        con.execute("UPDATE quotas SET max_uids=? WHERE scope=? AND key=?", (max_uids, scope, str(key)))
+    if weight is not None:
+        con.execute("UPDATE quotas SET weight=? WHERE scope=? AND key=?", (weight, scope, str(key)))
     con.commit(); con.close()
 
+def _check_quota(con, chat_id: int, uid: str, customer: str | None):
+    existing = con.execute("SELECT customer FROM subscriptions WHERE chat_id=? AND uid=?", (chat_id, uid)).fetchone()
+    if existing is None:  # cập nhật UID đã có thì không tính thêm vào quota chat
+        limit, _ = get_quota("chat", chat_id)
+        if limit:
+            used = con.execute("SELECT COUNT(*) FROM subscriptions WHERE chat_id=?", (chat_id,)).fetchone()[0]
+            if used >= limit:
+                raise QuotaExceeded(f"Chat này đã đạt giới hạn {limit} UID. Liên hệ admin để nâng quota.")
+    # UID mới, hoặc UID cũ chuyển sang khách hàng khác -> tính vào quota khách hàng mới
+    if customer and (existing is None or existing[0] != customer):
+        limit, _ = get_quota("customer", customer)
+        if limit:
+            used = con.execute("SELECT COUNT(*) FROM subscriptions WHERE customer=?", (customer,)).fetchone()[0]
+            if used >= limit:
+                raise QuotaExceeded(f"Khách hàng {customer} đã đạt giới hạn {limit} UID.")
+
+def add_subscription(chat_id:int, uid:str, url:str, note:str|None=None, customer:str|None=None, kind:str|None="profile"):
+    con = db()
+    try:
+        # khóa ghi trước khi đếm: nhiều update worker cùng /them không vượt quota
+        con.execute("BEGIN IMMEDIATE")
+        _check_quota(con, chat_id, uid, customer)
+        con.execute("INSERT OR IGNORE INTO profiles(uid,url) VALUES(?,?)", (uid,url))
+        con.execute("""
+            INSERT OR IGNORE INTO subscriptions(chat_id,uid,note,customer,kind)
+            VALUES(?,?,?,?,?)
+        """, (chat_id, uid, note, customer, kind))
+        if note is not None:
+            con.execute("UPDATE subscriptions SET note=? WHERE chat_id=? AND uid=?", (note, chat_id, uid))
+        if customer is not None:
+            con.execute("UPDATE subscriptions SET customer=? WHERE chat_id=? AND uid=?", (customer, chat_id, uid))
+        if kind is not None:
+            con.execute("UPDATE subscriptions SET kind=? WHERE chat_id=? AND uid=?", (kind, chat_id, uid))
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    finally:
+        con.close()
+
 def set_profile_status(uid:str, name:str|None, status:str):
     con = db()
     con.execute("UPDATE profiles SET name=COALESCE(?,name), last_status=? WHERE uid=?",
                 (name, status, uid))
     con.commit(); con.close()
 
+def get_profile_status(uid:str) -> str | None:
+    con = db()
+    row = con.execute("SELECT last_status FROM profiles WHERE uid=?", (uid,)).fetchone()
+    con.close()
+    return row[0] if row else None
+
 def list_subs(chat_id:int):
     con = db()
     rows = con.execute("""
@@ -185,93 +322,118 @@ def list_subs(chat_id:int):
     """,(chat_id,)).fetchall()
     con.close(); return rows
 
+def _archive_orphans(con, uid: str | None = None) -> int:
+    """Chuyển profile không còn subscription nào sang profiles_archive (1 UID hoặc toàn bộ)."""
+    where = "NOT EXISTS (SELECT 1 FROM subscriptions s WHERE s.uid=p.uid)"
+    args: tuple = ()
+    if uid is not None:
+        where += " AND p.uid=?"
+        args = (uid,)
+    con.execute(f"""
+        INSERT OR REPLACE INTO profiles_archive(uid,url,name,last_status,archived_at)
+        SELECT p.uid, p.url, p.name, p.last_status, ? FROM profiles p WHERE {where}
+    """, (now_iso(),) + args)
+    con.execute(f"""
+        DELETE FROM pending_checks WHERE uid IN (SELECT p.uid FROM profiles p WHERE {where})
+    """, args)
+    return con.execute(f"DELETE FROM profiles AS p WHERE {where}", args).rowcount
+
 def remove_subscription(chat_id:int, uid:str):
     con = db()
     con.execute("DELETE FROM subscriptions WHERE chat_id=? AND uid=?", (chat_id,uid))
+    # subscriber cuối cùng rời đi -> profile thôi được poll
+    _archive_orphans(con, uid)
     con.commit(); con.close()
 
-def get_all_uids():
+def sweep_orphans() -> int:
+    """Dọn profile mồ côi còn sót (dữ liệu cũ, xóa tay trong DB...)."""
     con = db()
-    rows = con.execute("SELECT uid, url, COALESCE(last_status,'') FROM profiles").fetchall()
-    con.close(); return rows
-
-def subscribers_of(uid:str):
-    con = db()
-    rows = [r[0] for r in con.execute("SELECT chat_id FROM subscriptions WHERE uid=?", (uid,)).fetchall()]
-    con.close(); return rows
+    n = _archive_orphans(con)
+    con.commit(); con.close()
+    if n:
+        LOGGER.info("Archived %d orphaned profiles", n)
+    return n
 
+class ProfileRow:
+    __slots__ = ("uid", "url", "prev", "kind")
 
-# ===================== FB STATUS DETECTION =====================
-def normalize_target(s: str):
-    s = s.strip()
-    if s.startswith("http"):
-        u = urlparse(s)
-        if "facebook.com" not in u.netloc:
-            raise ValueError("Đây không phải link Facebook hợp lệ.")
-        qs = parse_qs(u.query)
-        if "id" in qs and qs["id"][0].isdigit():
-            uid = qs["id"][0]
-            url = f"https://mbasic.facebook.com/profile.php?id={uid}"
-            return uid, url
-        slug = u.path.strip("/").split("/")[0]
-        if not slug:
-            raise ValueError("Không lấy được UID/username từ link.")
-        uid = slug
-        url = f"https://mbasic.facebook.com/{slug}"
-        return uid, url
-    else:
-        uid = s
-        if not re.match(r'^[A-Za-z0-9\.]+$', uid):
-            raise ValueError("UID/username không hợp lệ.")
-        if UID_RE.match(uid):
-            url = f"https://mbasic.facebook.com/profile.php?id={uid}"
-        else:
-            url = f"https://mbasic.facebook.com/{uid}"
-        return uid, url
+    def __init__(self, uid: str, url: str, prev: str, kind: str):
+        self.uid, self.url, self.prev, self.kind = uid, url, prev, kind
 
-def _try_fetch(url: str, headers: dict, timeout: int) -> tuple[str|None, str|None, str]:
-    try:
-        r = requests.get(url, headers=headers, timeout=timeout, allow_redirects=True)
-        final = r.url.lower()
-
-        if r.status_code in (404, 410):
-            return "DIE", None, final
-
-        text_lower = r.text.lower()
-        if any(phrase in text_lower for phrase in DEAD_PHRASES):
-            return "DIE", None, final
-
-        soup = BeautifulSoup(r.text, "html.parser")
-        name = None
-        og = soup.find("meta", attrs={"property": "og:title"})
-        if og and og.get("content"):
-            name = og["content"].strip()
-        if not name and soup.title and soup.title.text:
-            t = soup.title.text.strip()
-            low = t.lower()
-            if all(k not in low for k in ["facebook", "log in"]):
-                name = t
-        return "LIVE", name, final
-    except Exception:
-        return None, None, url
-
-def fetch_status_and_name(url: str, timeout: int = 20):
-    status, name, _ = _try_fetch(url, HEADERS, timeout)
-    if status is not None:
-        return status, name
+def _load_tenants() -> dict[int, float]:
+    """chat_id -> weight của mọi chat đang có subscription."""
+    con = db()
+    rows = con.execute("""
+        SELECT s.chat_id, COALESCE(q.weight, 1)
+        FROM (SELECT DISTINCT chat_id FROM subscriptions) s
+        LEFT JOIN quotas q ON q.scope='chat' AND q.key=CAST(s.chat_id AS TEXT)
+    """).fetchall()
+    con.close()
+    return {chat_id: max(weight, 0.01) for chat_id, weight in rows}
+
+def iter_fair_chunks(cycle_start: int, chunk_size: int = POLL_CHUNK_SIZE, batch: int = FAIR_BATCH):
+    """
+    Weighted fair queuing giữa các chat: mỗi lượt lấy `batch` UID của chat có virtual
+    time nhỏ nhất (vtime += số UID / weight), gom thành chunk cho check_many.
+    Mỗi chat duyệt subscriptions theo keyset (chat_id, uid) nên bộ nhớ chỉ phụ thuộc số chat.
+    Profile đã check trong chu kỳ này (last_checked >= cycle_start) được bỏ qua -> UID chung
+    nhiều chat chỉ check 1 lần và resume sau restart không check lại.
+    """
+    weights = _load_tenants()
+    heap = [(0.0, chat_id, "") for chat_id in weights]  # (vtime, chat_id, cursor uid)
+    heapq.heapify(heap)
+    known, reloaded = set(weights), time.monotonic()
+    chunk, seen = [], set()
+    while heap:
+        vtime, chat_id, cursor = heapq.heappop(heap)
+        con = db()
+        rows = con.execute("""
+            SELECT p.uid, p.url, COALESCE(p.last_status,''), COALESCE(s.kind,'profile'),
+                   COALESCE(p.last_checked, 0)
+            FROM subscriptions s JOIN profiles p ON p.uid=s.uid
+            WHERE s.chat_id=? AND s.uid > ? ORDER BY s.uid LIMIT ?
+        """, (chat_id, cursor, batch)).fetchall()
+        con.close()
+        if rows:
+            todo = [ProfileRow(*r[:4]) for r in rows if r[4] < cycle_start and r[0] not in seen]
+            seen.update(r.uid for r in todo)
+            chunk.extend(todo)
+            heapq.heappush(heap, (vtime + len(rows) / weights[chat_id], chat_id, rows[-1][0]))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk, seen = [], set()
+        # chat mới thêm UID giữa chu kỳ: vào hàng với vtime hiện tại (không được "bù" lượt)
+        if time.monotonic() - reloaded > 60:
+            reloaded = time.monotonic()
+            floor = heap[0][0] if heap else vtime
+            for cid, w in _load_tenants().items():
+                weights[cid] = w
+                if cid not in known:
+                    known.add(cid)
+                    heapq.heappush(heap, (floor, cid, ""))
+    if chunk:
+        yield chunk
+
+def mark_checked(uids: list[str], when: int):
+    con = db()
+    con.executemany("UPDATE profiles SET last_checked=? WHERE uid=?", [(when, u) for u in uids])
+    con.commit(); con.close()
 
-    alt = url.replace("mbasic.facebook", "m.facebook") if "mbasic.facebook" in url else url.replace("m.facebook", "mbasic.facebook")
-    status, name, _ = _try_fetch(alt, HEADERS, timeout)
-    if status is not None:
-        return status, name
+def get_state(key: str, default: str = "") -> str:
+    con = db()
+    row = con.execute("SELECT value FROM poll_state WHERE key=?", (key,)).fetchone()
+    con.close()
+    return row[0] if row else default
 
-    crawler_headers = {**HEADERS, "User-Agent": "facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)"}
-    alt2 = alt.replace("m.facebook", "www.facebook").replace("mbasic.facebook", "www.facebook")
-    status, name, _ = _try_fetch(alt2, crawler_headers, timeout)
-    if status is not None:
-        return status, name
+def set_state(key: str, value: str):
+    con = db()
+    con.execute("INSERT OR REPLACE INTO poll_state(key, value) VALUES(?, ?)", (key, value))
+    con.commit(); con.close()
 
-    return None, None
+def subscribers_of(uid:str):
+    con = db()
+    rows = [r[0] for r in con.execute("SELECT chat_id FROM subscriptions WHERE uid=?", (uid,)).fetchall()]
+    con.close(); return rows
 
 
 # ===================== UI TEXT =====================
@@ -283,13 +445,21 @@ HELP = (
 "/xoa <uid> – Bỏ theo dõi\n"
 "/myid – Xem User ID & quyền hiện tại\n"
 "\n*Chỉ admin*: /grant <user_id> [user|admin], /revoke <user_id>, /who\n"
+"/quota – Xem quota, /setquota chat|customer ... – Đặt quota & weight\n"
 )
 
 def line_box():
     return "____________________________"
 
-def card_added(uid, note, customer, kind, added_when, status, url):
-    status_icon = "🟢 LIVE" if status=="LIVE" else "🔴 DIE"
+STATUS_ICONS = {"LIVE": "🟢 LIVE", "DIE": "🔴 DIE"}
+STATUS_UNKNOWN = "⏳ Chưa rõ (sẽ kiểm tra lại)"
+
+def status_label(status, pending=None):
+    label = STATUS_ICONS.get(status, STATUS_UNKNOWN)
+    return f"{label} (đang xác nhận → {pending})" if pending else label
+
+def card_added(uid, note, customer, kind, added_when, status, url, pending=None):
+    status_icon = status_label(status, pending)
     note_display = note or "—"
     customer_display = customer or "—"
     kind_display = "Profile/Page" if (kind or "profile") == "profile" else "Group"
@@ -344,7 +514,7 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ===================== ACCESS GUARD =====================
 def guard(require_admin: bool = False):
-    async def _decorator(func):
+    def _decorator(func):
         async def _wrapped(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
             uid = update.effective_user.id if update.effective_user else None
             if uid is None:
@@ -426,6 +596,50 @@ async def who_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     lines = [f"- `{r[0]}` → *{r[1]}*" for r in rows]
     await update.effective_message.reply_text("👥 *Danh sách quyền:*\n" + "\n".join(lines), parse_mode=ParseMode.MARKDOWN)
 
+@guard(require_admin=True)
+async def quota_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    con = db()
+    chats = con.execute("""
+        SELECT s.chat_id, COUNT(*), q.max_uids, COALESCE(q.weight, 1)
+        FROM subscriptions s LEFT JOIN quotas q ON q.scope='chat' AND q.key=CAST(s.chat_id AS TEXT)
+        GROUP BY s.chat_id ORDER BY COUNT(*) DESC LIMIT 30
+    """).fetchall()
+    customers = con.execute("""
+        SELECT q.key, q.max_uids, (SELECT COUNT(*) FROM subscriptions WHERE customer=q.key)
+        FROM quotas q WHERE q.scope='customer' ORDER BY q.key
+    """).fetchall()
+    con.close()
+    fmt = lambda m, d: (m if m is not None else d) or "∞"
+    lines = [f"📊 *Quota* (mặc định: chat {DEFAULT_CHAT_QUOTA or '∞'}, KH {DEFAULT_CUSTOMER_QUOTA or '∞'})", "*Chat* (đang dùng/giới hạn, weight):"]
+    lines += [f"- `{c}` → {n}/{fmt(m, DEFAULT_CHAT_QUOTA)}, w={w:g}" for c, n, m, w in chats] or ["- (trống)"]
+    lines.append("*Khách hàng*:")
+    lines += [f"- {html.escape(k)} → {n}/{fmt(m, DEFAULT_CUSTOMER_QUOTA)}" for k, m, n in customers] or ["- (chưa set)"]
+    await update.effective_message.reply_text("\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+
+@guard(require_admin=True)
+async def setquota_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    args = context.args or []
+    usage = "Dùng: /setquota chat <chat_id> <max|0> [weight]\n/setquota customer <tên KH> <max|0>"
+    if len(args) < 3 or args[0] not in ("chat", "customer"):
+        await update.effective_message.reply_text(usage)
+        return
+    try:
+        scope = args[0]
+        if scope == "chat":
+            key, max_uids = int(args[1]), int(args[2])
+            weight = float(args[3]) if len(args) > 3 else None
+        else:
+            key, max_uids, weight = " ".join(args[1:-1]), int(args[-1]), None
+        if max_uids < 0 or (weight is not None and weight <= 0):
+            raise ValueError("max phải >= 0 và weight > 0")
+        set_quota(scope, key, max_uids, weight)
+        await update.effective_message.reply_text(
+            f"✅ Quota {scope} `{key}`: max={max_uids or '∞'}" + (f", weight={weight:g}" if weight else ""),
+            parse_mode=ParseMode.MARKDOWN
+        )
+    except Exception as e:
+        await update.effective_message.reply_text(f"❌ {e}\n{usage}")
+
 # ----- /them flow -----
 def parse_inline_add(text: str):
     parts = [p.strip() for p in text.split("|")]
@@ -444,17 +658,15 @@ async def them_entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             target, note, customer, kind = parse_inline_add(raw)
             uid, url = normalize_target(target)
-            status, name = fetch_status_and_name(url)
-            if status is None:
-                status = "DIE"   # mặc định an toàn
-            add_subscription(update.effective_chat.id, uid, url, note, customer, kind)
-            set_profile_status(uid, name, status)
+            add_subscription(update.effective_chat.id, uid, url, note, customer, kind)  # quota check trước khi probe
+            status, name = await afetch_status_and_name(url)
+            status, pending = apply_handler_probe(uid, url, get_profile_status(uid), status, name, None)
             kb = InlineKeyboardMarkup([
                 [InlineKeyboardButton("🔗 Mở Facebook", url=url)],
                 [InlineKeyboardButton("🛑 Dừng theo dõi UID này", callback_data=f"stop:{uid}")]
             ])
             await update.effective_message.reply_text(
-                card_added(uid, note, customer, kind, now_iso(), status, url),
+                card_added(uid, note, customer, kind, now_iso(), status, url, pending),
                 parse_mode=ParseMode.MARKDOWN, reply_markup=kb, disable_web_page_preview=True
             )
         except Exception as e:
@@ -519,19 +731,22 @@ async def them_got_customer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     note, customer = info.get("note"), info.get("customer")
     kind = info.get("kind", "profile")
 
-    status, name = fetch_status_and_name(url)
-    if status is None:
-        status = "DIE"
+    try:
+        add_subscription(update.effective_chat.id, uid, url, note, customer, kind)
+    except QuotaExceeded as e:
+        await update.effective_message.reply_text(f"❌ {e}")
+        context.user_data.pop("add", None)
+        return ConversationHandler.END
 
-    add_subscription(update.effective_chat.id, uid, url, note, customer, kind)
-    set_profile_status(uid, name, status)
+    status, name = await afetch_status_and_name(url)
+    status, pending = apply_handler_probe(uid, url, get_profile_status(uid), status, name, None)
 
     kb = InlineKeyboardMarkup([
         [InlineKeyboardButton("🔗 Mở Facebook", url=url)],
         [InlineKeyboardButton("🛑 Dừng theo dõi UID này", callback_data=f"stop:{uid}")]
     ])
     await update.effective_message.reply_text(
-        card_added(uid, note, customer, kind, now_iso(), status, url),
+        card_added(uid, note, customer, kind, now_iso(), status, url, pending),
         parse_mode=ParseMode.MARKDOWN, reply_markup=kb, disable_web_page_preview=True
     )
     context.user_data.pop("add", None)
@@ -550,16 +765,16 @@ async def list_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_message.reply_text("Chưa có UID nào. Dùng /them để bắt đầu.")
         return
 
+    # check song song cả danh sách, rồi mới gửi lần lượt
+    results = {}
+    async for row, res in acheck_many(rows, url_of=lambda r: r[3]):
+        results[row[0]] = res
+
     for uid, _, prev_status, url, note, customer, kind in rows:
-        status, name = fetch_status_and_name(url)
-        if status is None:
-            status = prev_status if prev_status else "DIE"
-        if name:
-            set_profile_status(uid, name, status)
-        else:
-            set_profile_status(uid, None, status)
+        status, name, variant = results[uid]
+        status, pending = apply_handler_probe(uid, url, prev_status or None, status, name, variant)
 
-        status_icon = "🟢 LIVE" if status=="LIVE" else "🔴 DIE"
+        status_icon = status_label(status, pending)
         note_display = note or "—"
         customer_display = customer or "—"
         kind_display = "Profile/Page" if (kind or "profile") == "profile" else "Group"
@@ -580,7 +795,7 @@ async def list_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_message.reply_text(
             text, parse_mode=ParseMode.MARKDOWN, reply_markup=kb, disable_web_page_preview=True
         )
-        time.sleep(0.35)
+        await asyncio.sleep(0.35)
 
 @guard()
 async def remove_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -605,61 +820,566 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_reply_markup(reply_markup=None)
         await query.message.reply_text(f"🛑 Đã dừng theo dõi UID {uid}")
 
+async def _alert_turn(application: Application):
+    """Giãn đều alert theo ALERT_RATE: fan-out lớn không đập vào giới hạn toàn bot rồi ăn 429."""
+    pace = application.bot_data.setdefault("alert_pace", {"next": 0.0})
+    now = asyncio.get_running_loop().time()
+    at = max(now, pace["next"])
+    pace["next"] = at + 1 / ALERT_RATE
+    if at > now:
+        await asyncio.sleep(at - now)
+
+def _outbox_done(outbox_id: int):
+    con = db()
+    con.execute("DELETE FROM alert_outbox WHERE id=?", (outbox_id,))
+    con.commit(); con.close()
+
+async def _send_alert(application: Application, outbox_id: int | None = None, **kwargs):
+    # Mỗi subscriber là 1 task, nhưng chỉ ALERT_CONCURRENCY task giữ kết nối cùng lúc;
+    # 429 chờ đúng retry_after, lỗi mạng/timeout thử lại với backoff thay vì bỏ tin.
+    # Dòng outbox chỉ bị xóa khi Telegram đã nhận (hoặc từ chối vĩnh viễn).
+    sem = application.bot_data.get("alert_sem")
+    if sem is None:
+        sem = application.bot_data["alert_sem"] = asyncio.Semaphore(max(1, ALERT_CONCURRENCY))
+    for attempt in range(ALERT_MAX_RETRIES + 1):
+        try:
+            async with sem:
+                await _alert_turn(application)
+                msg = await application.bot.send_message(**kwargs)
+            if outbox_id is not None:
+                await asyncio.to_thread(_outbox_done, outbox_id)
+            return msg
+        except RetryAfter as e:
+            if attempt == ALERT_MAX_RETRIES:
+                raise
+            await asyncio.sleep(e.retry_after)
+        except (BadRequest, Forbidden):
+            # chat không tồn tại, bot bị chặn, markdown lỗi...: gửi lại cũng vậy
+            if outbox_id is not None:
+                await asyncio.to_thread(_outbox_done, outbox_id)
+            raise
+        except NetworkError as e:  # gồm TimedOut
+            if attempt == ALERT_MAX_RETRIES:
+                raise
+            LOGGER.info("Alert to %s failed (%s), retry %d", kwargs.get("chat_id"), e, attempt + 1)
+            await asyncio.sleep(min(2 ** attempt, 30))
+
+def _spawn_alert(application: Application, coro):
+    # chạy trên event loop; sau khi graceful_stop đóng cổng thì để dòng outbox cho lần start sau
+    if application.bot_data.get("alerts_closed"):
+        coro.close()
+        return
+    tasks = application.bot_data.setdefault("alert_tasks", set())
+    task = application.create_task(coro)
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+
+def _dispatch_outbox(application: Application, rows):
+    """rows: (outbox_id, chat_id, uid, url, text) -> lên lịch gửi trên event loop của bot."""
+    loop = application.bot_data.get("loop")
+    if loop is None:
+        LOGGER.warning("Event loop not ready, %d alerts stay in outbox", len(rows))
+        return
+    for outbox_id, chat_id, uid, url, text in rows:
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔗 Mở Facebook", url=url)],
+            [InlineKeyboardButton("🛑 Dừng theo dõi UID này", callback_data=f"stop:{uid}")]
+        ])
+        loop.call_soon_threadsafe(
+            _spawn_alert, application,
+            _send_alert(
+                application, outbox_id, chat_id=chat_id, text=text, parse_mode=ParseMode.MARKDOWN,
+                disable_web_page_preview=True, reply_markup=keyboard
+            )
+        )
+
+def notify_change(application: Application, uid: str, url: str, old: str, new: str):
+    # poll_once chạy trong thread của scheduler -> ghi outbox trước, rồi đẩy việc gửi về event loop
+    con = db()
+    subs = con.execute("""
+        SELECT chat_id, COALESCE(note,''), COALESCE(customer,'')
+        FROM subscriptions WHERE uid=?
+    """, (uid,)).fetchall()
+    queued_at = now_iso()
+    rows = []
+    with con:
+        for chat_id, note, customer in subs:
+            text = card_alert(uid, note, customer, url, old, new)
+            cur = con.execute("INSERT INTO alert_outbox(chat_id,uid,url,text,queued_at) VALUES(?,?,?,?,?)",
+                              (chat_id, uid, url, text, queued_at))
+            rows.append((cur.lastrowid, chat_id, uid, url, text))
+    con.close()
+    _dispatch_outbox(application, rows)
+
+def replay_outbox(application: Application):
+    # alert chưa giao xong trước lần tắt/crash trước
+    con = db()
+    rows = con.execute("SELECT id, chat_id, uid, url, text FROM alert_outbox ORDER BY id").fetchall()
+    con.close()
+    if rows:
+        LOGGER.info("Replaying %d undelivered alerts", len(rows))
+        _dispatch_outbox(application, rows)
+
+# STOP_EVENT (fb_checker) set khi shutdown: poller/confirm lane ngừng nhận việc mới,
+# probe đang chạy bỏ các endpoint còn lại
+_POLL_IDLE = threading.Event()
+_POLL_IDLE.set()
+CHECKPOINT_EVERY = 50  # ghi last_checked sau mỗi N kết quả để SIGKILL mất ít việc
+
 def poll_once(application: Application):
-    for uid, url, prev in get_all_uids():
-        status, name = fetch_status_and_name(url)
-        if status is None:
-            continue
-        if prev != status:
-            set_profile_status(uid, name, status)
-            for chat_id in subscribers_of(uid):
-                con = db()
-                row = con.execute("""
-                    SELECT COALESCE(note,''), COALESCE(customer,'')
-                    FROM subscriptions WHERE chat_id=? AND uid=?
-                """, (chat_id, uid)).fetchone()
-                con.close()
-                note, customer = (row or ("",""))
-                text = card_alert(uid, note, customer, url, prev if prev else "Unknown", status)
-                keyboard = InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🔗 Mở Facebook", url=url)],
-                    [InlineKeyboardButton("🛑 Dừng theo dõi UID này", callback_data=f"stop:{uid}")]
-                ])
-                application.create_task(
-                    application.bot.send_message(
-                        chat_id=chat_id, text=text, parse_mode=ParseMode.MARKDOWN,
-                        disable_web_page_preview=True, reply_markup=keyboard
-                    )
-                )
+    if STOP_EVENT.is_set():
+        return
+    _POLL_IDLE.clear()
+    try:
+        _poll_cycle(application)
+    finally:
+        _POLL_IDLE.set()
+
+def _poll_cycle(application: Application):
+    # Tiếp tục chu kỳ dở nếu bị restart/deploy cắt ngang: profile đã check
+    # (last_checked >= cycle_start) được bỏ qua
+    restore_pending_checks()  # xác nhận còn dở (mơ hồ lần trước) được thử lại
+    cycle_start = int(get_state("cycle_start") or 0)
+    if cycle_start:
+        LOGGER.info("Resuming poll cycle started at %s", datetime.fromtimestamp(cycle_start))
+    else:
+        cycle_start = int(time.time())
+        set_state("cycle_start", str(cycle_start))
+    for chunk in iter_fair_chunks(cycle_start):
+        # check_many chạy song song theo số slot của proxy pool -> thông lượng tăng theo số egress
+        done, checkpointed = [], 0
+        results = check_many(chunk, url_of=lambda r: r.url, kind_of=lambda r: r.kind)
+        for row, (status, name, variant) in results:
+            _apply_result(application, row.uid, row.url, row.prev, status, name, variant)
+            if status is not None:
+                done.append(row.uid)  # probe mơ hồ: chưa tính là đã check, resume sẽ thử lại
+            if STOP_EVENT.is_set():
+                break
+            if len(done) >= CHECKPOINT_EVERY:
+                mark_checked(done, int(time.time()))
+                checkpointed += len(done)
+                done = []
+        # ghi checkpoint TRƯỚC khi close(): close hủy probe chưa chạy và chờ probe đang bay
+        mark_checked(done, int(time.time()))
+        checkpointed += len(done)
+        results.close()
+        if STOP_EVENT.is_set():
+            LOGGER.info("Poll cycle interrupted, %d profiles checkpointed in last chunk", checkpointed)
+            return
+    set_state("cycle_start", "")
+    LOGGER.info("Poll cycle done. Probes: %s Egress: %s",
+                probe_stats_snapshot(reset=True), PROXY_POOL.snapshot())
+
+def _apply_result(application: Application, uid, url, prev, status, name, variant):
+    if status is None:
+        return
+    if prev != status:
+        if prev:
+            # nghi đổi LIVE<->DIE: chuyển sang làn xác nhận, chưa báo
+            enqueue_confirm(uid, url, prev, status, variant)
         else:
-            if name:
-                set_profile_status(uid, name, status)
-        time.sleep(0.6)
+            set_profile_status(uid, name, status)
+            CHANGE_BUS.publish(uid, url, name, None, status)
+            notify_change(application, uid, url, "Unknown", status)
+    else:
+        if name:
+            set_profile_status(uid, name, status)
 
+def apply_handler_probe(uid, url, prev, status, name, variant) -> tuple[str | None, str | None]:
+    """
+    Kết quả 1 probe lẻ từ /them, /danhsach -> (status để hiển thị, status đang chờ xác nhận).
+    Chỉ status lần đầu được ghi thẳng; khác status đã lưu thì đi qua làn xác nhận như poller
+    (1 probe nhiễu không được ghi đè, flip thật vẫn được báo + publish sau khi xác nhận).
+    """
+    if status is None:
+        return prev, None  # probe mơ hồ: hiện status cũ, không ghi
+    if prev and prev != status:
+        enqueue_confirm(uid, url, prev, status, variant)
+        return prev, status
+    set_profile_status(uid, name, status)
+    if not prev:
+        CHANGE_BUS.publish(uid, url, name, None, status)
+    return status, None
+
+
+# ===================== CONFIRM LANE =====================
+# Thay đổi trạng thái nghi ngờ được probe lại ngay trên endpoint khác
+# (vài giây), chỉ báo khi xác nhận -> không chờ tới chu kỳ sau, không spam flap.
+_CONFIRM_QUEUE: "queue.Queue[tuple]" = queue.Queue()
+_CONFIRM_PENDING: set[str] = set()
+_CONFIRM_LOCK = threading.Lock()
+
+def enqueue_confirm(uid: str, url: str, prev: str, status: str, variant: int | None, persist: bool = True) -> bool:
+    with _CONFIRM_LOCK:
+        if uid in _CONFIRM_PENDING:
+            return False
+        _CONFIRM_PENDING.add(uid)
+    if persist:
+        # lưu trước khi xác nhận để restart giữa chừng không làm mất thay đổi
+        con = db()
+        con.execute("INSERT OR REPLACE INTO pending_checks(uid,url,prev,status,variant,queued_at) VALUES(?,?,?,?,?,?)",
+                    (uid, url, prev, status, variant, now_iso()))
+        con.commit(); con.close()
+    _CONFIRM_QUEUE.put((uid, url, prev, status, variant))
+    return True
+
+def restore_pending_checks():
+    """Đưa lại vào làn xác nhận các thay đổi còn trong pending_checks (sau restart hoặc lần trước mơ hồ)."""
+    con = db()
+    rows = con.execute("SELECT uid, url, prev, status, variant FROM pending_checks").fetchall()
+    con.close()
+    restored = sum(enqueue_confirm(uid, url, prev, status, variant, persist=False)
+                   for uid, url, prev, status, variant in rows)
+    if restored:
+        LOGGER.info("Restored %d pending confirmations", restored)
 
-# ===================== HEALTH CHECK HTTP =====================
+def _clear_pending(uid: str):
+    con = db()
+    con.execute("DELETE FROM pending_checks WHERE uid=?", (uid,))
+    con.commit(); con.close()
+
+def _profile_exists(uid: str) -> bool:
+    con = db()
+    row = con.execute("SELECT 1 FROM profiles WHERE uid=?", (uid,)).fetchone()
+    con.close()
+    return row is not None
+
+def confirm_worker(application: Application):
+    while True:
+        uid, url, prev, status, variant = _CONFIRM_QUEUE.get()
+        if STOP_EVENT.is_set():
+            # đang shutdown: để nguyên trong pending_checks cho lần chạy sau
+            _CONFIRM_QUEUE.task_done()
+            continue
+        try:
+            # profile đã bị archive (hết subscriber) sau khi vào hàng: bỏ, không publish/ghi status
+            if not _profile_exists(uid):
+                _clear_pending(uid)
+                continue
+            verdict, name = confirm_status(url, status, skip=variant,
+                                           probes=CONFIRM_PROBES, delay=CONFIRM_DELAY_SEC)
+            if not _profile_exists(uid):
+                _clear_pending(uid)
+                continue
+            if verdict == CONFIRMED:
+                set_profile_status(uid, name, status)
+                CHANGE_BUS.publish(uid, url, name, prev, status)
+                notify_change(application, uid, url, prev, status)  # vào alert_outbox trước khi bỏ pending
+                _clear_pending(uid)
+            elif verdict == CONTRADICTED:
+                LOGGER.info("Flap ignored for %s (%s -> %s)", uid, prev, status)
+                _clear_pending(uid)
+            else:
+                # không probe nào đủ trả lời: giữ trong pending_checks, thử lại đầu chu kỳ sau
+                LOGGER.info("Confirmation inconclusive for %s (%s -> %s), retrying next cycle", uid, prev, status)
+        except Exception:
+            LOGGER.exception("Confirm re-check failed for %s", uid)
+        finally:
+            with _CONFIRM_LOCK:
+                _CONFIRM_PENDING.discard(uid)
+            _CONFIRM_QUEUE.task_done()
+
+
+# ===================== CHANGE FEED =====================
+class ChangeBus:
+    """
+    Bus sự kiện đổi trạng thái trong process. Mỗi sự kiện có id tăng dần (lưu ở
+    change_events) làm offset để consumer resume; đọc thường phục vụ từ ring buffer
+    trong RAM, chỉ consumer tụt quá xa mới đọc SQLite.
+    """
+
+    def __init__(self, maxlen: int):
+        self.events = deque(maxlen=maxlen)
+        self.cond = threading.Condition()
+        self.loaded = False
+        self.last_id = 0  # id mới nhất kể cả khi ring buffer rỗng (maxlen=0)
+
+    def _load(self):
+        con = db()
+        rows = con.execute("""
+            SELECT id, uid, url, name, old, new, at FROM change_events
+            ORDER BY id DESC LIMIT ?
+        """, (self.events.maxlen,)).fetchall()
+        self.last_id = con.execute("SELECT COALESCE(MAX(id), 0) FROM change_events").fetchone()[0]
+        con.close()
+        self.events.extend(self._row(r) for r in reversed(rows))
+        self.loaded = True
+
+    @staticmethod
+    def _row(r):
+        return {"id": r[0], "uid": r[1], "url": r[2], "name": r[3], "old": r[4], "new": r[5], "at": r[6]}
+
+    def publish(self, uid: str, url: str, name: str | None, old: str | None, new: str):
+        at = now_iso()
+        with self.cond:
+            if not self.loaded:
+                self._load()
+            con = db()
+            cur = con.execute("INSERT INTO change_events(uid,url,name,old,new,at) VALUES(?,?,?,?,?,?)",
+                              (uid, url, name, old, new, at))
+            con.commit(); con.close()
+            self.events.append(self._row((cur.lastrowid, uid, url, name, old, new, at)))
+            self.last_id = cur.lastrowid
+            self.cond.notify_all()
+
+    def since(self, offset: int, limit: int = 500) -> list[dict]:
+        with self.cond:
+            if not self.loaded:
+                self._load()
+            if offset >= self.last_id:
+                return []
+            # RAM chỉ phục vụ khi buffer còn giữ sự kiện ngay sau offset
+            if self.events and offset >= self.events[0]["id"] - 1:
+                return [e for e in self.events if e["id"] > offset][:limit]
+        con = db()
+        rows = con.execute("""
+            SELECT id, uid, url, name, old, new, at FROM change_events
+            WHERE id > ? ORDER BY id LIMIT ?
+        """, (offset, limit)).fetchall()
+        con.close()
+        return [self._row(r) for r in rows]
+
+    def wait(self, offset: int, timeout: float, limit: int = 500) -> list[dict]:
+        """Long-poll: trả ngay nếu có sự kiện > offset, không thì chờ tối đa timeout."""
+        events = self.since(offset, limit)
+        if events:
+            return events
+        with self.cond:
+            self.cond.wait_for(lambda: self.last_id > offset, timeout=timeout)
+        return self.since(offset, limit)
+
+    def head(self) -> int:
+        with self.cond:
+            if not self.loaded:
+                self._load()
+            return self.last_id
+
+    def trim(self, keep: int) -> int:
+        """Xóa sự kiện cũ trong SQLite, chỉ giữ `keep` id mới nhất (consumer tụt xa hơn đọc từ id cũ nhất còn lại)."""
+        if keep <= 0:
+            return 0
+        cutoff = self.head() - keep
+        con = db()
+        n = con.execute("DELETE FROM change_events WHERE id <= ?", (cutoff,)).rowcount
+        con.commit(); con.close()
+        with self.cond:
+            while self.events and self.events[0]["id"] <= cutoff:
+                self.events.popleft()
+        if n:
+            LOGGER.info("Trimmed %d old change events", n)
+        return n
+
+
+CHANGE_BUS = ChangeBus(FEED_BUFFER)
+
+
+# ===================== HEALTH CHECK / WEBHOOK / FEED HTTP =====================
 class HealthHandler(BaseHTTPRequestHandler):
     def do_GET(self):
-        if self.path in ("/", "/healthz"):
+        u = urlparse(self.path)
+        if u.path in ("/", "/healthz"):
             self.send_response(200); self.end_headers()
             self.wfile.write(b"OK")
+        elif u.path in ("/changes", "/events") and FEED_TOKEN:
+            qs = parse_qs(u.query)
+            token = self.headers.get("Authorization", "").removeprefix("Bearer ").strip() or qs.get("token", [""])[0]
+            # so sánh bytes: compare_digest với str không phải ASCII sẽ raise TypeError
+            if not hmac.compare_digest(token.encode(), FEED_TOKEN.encode()):
+                self.send_response(401); self.end_headers()
+                return
+            try:
+                since = int(qs.get("since", [self.headers.get("Last-Event-ID") or 0])[0])
+                limit = min(int(qs.get("limit", ["500"])[0]), 5000)
+                wait = min(float(qs.get("wait", ["0"])[0]), 60)
+                if limit < 1 or wait < 0:
+                    raise ValueError
+            except ValueError:
+                self.send_response(400); self.end_headers()
+                return
+            if u.path == "/changes":
+                self._send_changes(since, limit, wait)
+            else:
+                self._stream_events(since, limit)
         else:
             self.send_response(404); self.end_headers()
 
-def run_health_server():
+    def _send_changes(self, since: int, limit: int, wait: float):
+        events = CHANGE_BUS.wait(since, wait, limit) if wait else CHANGE_BUS.since(since, limit)
+        body = json.dumps({
+            "events": events,
+            "next": events[-1]["id"] if events else max(since, 0),
+        }, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream_events(self, since: int, limit: int):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        try:
+            while not STOP_EVENT.is_set():
+                events = CHANGE_BUS.wait(since, 15, limit)
+                if not events:
+                    self.wfile.write(b": keepalive\n\n")  # giữ kết nối qua proxy/LB
+                for e in events:
+                    data = json.dumps(e, ensure_ascii=False)
+                    self.wfile.write(f"id: {e['id']}\nevent: status\ndata: {data}\n\n".encode("utf-8"))
+                    since = e["id"]
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_POST(self):
+        application = self.server.application
+        if application is None or self.path != WEBHOOK_PATH:
+            self.send_response(404); self.end_headers()
+            return
+        token = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        # header được decode latin-1: so sánh bytes để byte > 0x7f không làm compare_digest raise
+        if not hmac.compare_digest(token.encode(), (WEBHOOK_SECRET or "").encode()):
+            self.send_response(403); self.end_headers()
+            return
+        loop = application.bot_data.get("loop")
+        if loop is None:
+            self.send_response(503); self.end_headers()
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            update = Update.de_json(json.loads(self.rfile.read(length)), application.bot)
+        except Exception:
+            self.send_response(400); self.end_headers()
+            return
+        asyncio.run_coroutine_threadsafe(application.update_queue.put(update), loop).result(timeout=10)
+        self.send_response(200); self.end_headers()
+
+def run_health_server(application: Application | None = None):
     port = int(os.getenv("PORT", "8080"))
-    server = HTTPServer(("0.0.0.0", port), HealthHandler)
+    server = ThreadingHTTPServer(("0.0.0.0", port), HealthHandler)
+    server.application = application  # chỉ set khi chạy webhook mode
     server.serve_forever()
 
 
 # ===================== MAIN =====================
+def drain_workers(application: Application, timeout: float = DRAIN_TIMEOUT_SEC):
+    """
+    Dừng poller + làn xác nhận, chờ việc đang chạy tối đa `timeout` giây tổng cộng.
+    Việc dở đã nằm trong checkpoint (last_checked, pending_checks) cho lần chạy sau.
+    """
+    deadline = time.monotonic() + timeout
+    STOP_EVENT.set()
+    scheduler = application.bot_data.get("scheduler")
+    if scheduler is not None and scheduler.running:
+        scheduler.shutdown(wait=False)
+    if not _POLL_IDLE.wait(max(0.0, deadline - time.monotonic())):
+        LOGGER.warning("Poll still running after %ss drain, leaving it to the checkpoint", timeout)
+    while _CONFIRM_QUEUE.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.2)
+    LOGGER.info("Background workers drained")
+
+async def graceful_stop(application: Application):
+    # poller, confirm lane và alert đang gửi dùng chung 1 hạn DRAIN_TIMEOUT_SEC
+    deadline = time.monotonic() + DRAIN_TIMEOUT_SEC
+    await asyncio.to_thread(drain_workers, application, DRAIN_TIMEOUT_SEC)
+    tasks = application.bot_data.get("alert_tasks")
+    if tasks:
+        _, pending = await asyncio.wait(set(tasks), timeout=max(0.0, deadline - time.monotonic()))
+        for task in pending:
+            task.cancel()
+        if pending:
+            LOGGER.warning("%d alerts unsent after drain, kept in outbox for next start", len(pending))
+    application.bot_data["alerts_closed"] = True
+
+async def _stop_polling(application: Application):
+    await graceful_stop(application)
+    application.stop_running()  # alert chưa gửi đã bị hủy, nằm lại trong alert_outbox
+
+def start_background(application: Application):
+    if not BACKGROUND_WORKERS:
+        LOGGER.info("BACKGROUND_WORKERS=0: serving updates only (no poller, confirm lane or sweeps)")
+        return
+    # chạy poll ngay để tiếp tục từ checkpoint, sau đó theo chu kỳ
+    scheduler = BackgroundScheduler(timezone="Asia/Ho_Chi_Minh")
+    scheduler.add_job(lambda: poll_once(application), "interval",
+                      seconds=CHECK_INTERVAL_SEC, max_instances=1,
+                      next_run_time=datetime.now(timezone.utc))
+    scheduler.add_job(sweep_orphans, "interval", seconds=ORPHAN_SWEEP_SEC, max_instances=1,
+                      next_run_time=datetime.now(timezone.utc))
+    scheduler.add_job(lambda: CHANGE_BUS.trim(FEED_RETENTION), "interval",
+                      seconds=ORPHAN_SWEEP_SEC, max_instances=1)
+    scheduler.start()
+    application.bot_data["scheduler"] = scheduler
+
+    # confirm lane + alert còn kẹt từ lần chạy trước
+    replay_outbox(application)
+    restore_pending_checks()
+    for _ in range(max(1, CONFIRM_WORKERS)):
+        threading.Thread(target=confirm_worker, args=(application,), daemon=True).start()
+
+async def post_init(application: Application):
+    # poller/confirm lane chỉ khởi động khi đã có event loop để gửi alert
+    loop = asyncio.get_running_loop()
+    application.bot_data["loop"] = loop
+    start_background(application)
+    if not WEBHOOK_URL:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(
+                sig, lambda: STOP_EVENT.is_set() or application.create_task(_stop_polling(application))
+            )
+
+async def run_webhook(application: Application):
+    # Không dùng Application.run_webhook vì nó tự mở server riêng,
+    # trong khi PORT đã do health server giữ.
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with application:
+        await post_init(application)
+        await application.bot.set_webhook(
+            WEBHOOK_URL, secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES
+        )
+        await application.start()
+        LOGGER.info("Webhook mode on %s (%d update workers)", WEBHOOK_PATH, UPDATE_WORKERS)
+        await stop.wait()
+        await graceful_stop(application)
+        await application.stop()
+
 def main():
     if not BOT_TOKEN or ":" not in BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN không hợp lệ hoặc không nạp được từ .env")
 
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET bắt buộc khi bật WEBHOOK_URL")
+
     seed_allowed_from_env()
 
-    application = Application.builder().token(BOT_TOKEN).build()
+    builder = (
+        Application.builder().token(BOT_TOKEN).post_init(post_init)
+        .concurrent_updates(max(1, UPDATE_WORKERS))
+    )
+    if WEBHOOK_URL:
+        builder = builder.updater(None)
+    application = build_application(builder)
+
+    # scheduler + confirm lane khởi động trong post_init
+
+    # health server (+ webhook endpoint)
+    threading.Thread(target=run_health_server, args=(application if WEBHOOK_URL else None,), daemon=True).start()
+
+    LOGGER.info("Bot is running...")
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling(close_loop=False, stop_signals=None)
+
+def build_application(builder) -> Application:
+    """Gắn handler lên Application (dùng chung cho main và tools/loadtest_alerts.py)."""
+    application = builder.build()
     application.add_error_handler(error_handler)
 
     # user-facing
@@ -670,6 +1390,8 @@ def main():
     application.add_handler(CommandHandler("grant", grant_cmd))
     application.add_handler(CommandHandler("revoke", revoke_cmd))
     application.add_handler(CommandHandler("who", who_cmd))
+    application.add_handler(CommandHandler("quota", quota_cmd))
+    application.add_handler(CommandHandler("setquota", setquota_cmd))
 
     # them conversation
     conv_them = ConversationHandler(
@@ -689,18 +1411,7 @@ def main():
     application.add_handler(CommandHandler("danhsach", list_cmd))
     application.add_handler(CommandHandler("xoa", remove_cmd))
     application.add_handler(CallbackQueryHandler(button_handler))
-
-    # scheduler
-    scheduler = BackgroundScheduler(timezone="Asia/Ho_Chi_Minh")
-    scheduler.add_job(lambda: poll_once(application), "interval",
-                      seconds=CHECK_INTERVAL_SEC, max_instances=1)
-    scheduler.start()
-
-    # health server
-    threading.Thread(target=run_health_server, daemon=True).start()
-
-    LOGGER.info("Bot is running...")
-    application.run_polling(close_loop=False)
+    return application
 
 if __name__ == "__main__":
     db()  # ensure schema
@@ -3,11 +3,13 @@ import os
 import re
 import time
 import json
+import sqlite3
+import threading
 from datetime import datetime
 import requests
 import telebot
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
-from check_live_sync import check_live
+from fb_checker import check_many, profile_url
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")  # export BOT_TOKEN=xxx
 if not BOT_TOKEN:
@@ -15,12 +17,13 @@ if not BOT_TOKEN:
 
 bot = telebot.TeleBot(BOT_TOKEN, parse_mode="HTML")
 
-# Lưu tạm trong RAM (có thể thay bằng DB/Redis khi triển khai thật)
-# tracking: uid -> {"note": str, "customer": str, "added": ts, "following": bool}
-tracking = {}
+DB_PATH = os.getenv("LIVE_BOT_DB", "live_bot.db")
+STATUS_TTL_SEC = int(os.getenv("STATUS_TTL_SEC", "300"))  # status cũ hơn thì refresh nền
+REFRESH_INTERVAL_SEC = 30
 
 GREEN = "🟢"
 RED = "🔴"
+PENDING = "⏳"
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120 Safari/537.36"
 
 MENU_TEXT = (
@@ -40,9 +43,122 @@ MENU_TEXT = (
     "• /getuid <code>&lt;link_facebook&gt;</code>\n"
 )
 
+# ---------- Storage ----------
+# tracking lưu trong SQLite: uid -> note, customer, added, following (+ status/checked_at làm cache)
+
+def db():
+    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS tracking(
+        uid TEXT PRIMARY KEY,
+        note TEXT,
+        customer TEXT,
+        added INTEGER,
+        following INTEGER NOT NULL DEFAULT 1,
+        status TEXT,
+        checked_at INTEGER
+    )
+    """)
+    return conn
+
+def get_tracked(uid: str) -> dict | None:
+    con = db()
+    row = con.execute("SELECT note, customer, added, following FROM tracking WHERE uid=?", (uid,)).fetchone()
+    con.close()
+    if not row:
+        return None
+    return {"note": row[0], "customer": row[1], "added": row[2], "following": bool(row[3])}
+
+def list_tracked(limit: int = 50) -> list[tuple[str, dict]]:
+    con = db()
+    rows = con.execute("SELECT uid, note, customer, added, following FROM tracking ORDER BY added, uid LIMIT ?",
+                       (limit,)).fetchall()
+    con.close()
+    return [(r[0], {"note": r[1], "customer": r[2], "added": r[3], "following": bool(r[4])}) for r in rows]
+
+def set_following(uid: str, following: bool):
+    con = db()
+    con.execute("UPDATE tracking SET following=? WHERE uid=?", (int(following), uid))
+    con.commit(); con.close()
+
+def untrack(uid: str) -> bool:
+    con = db()
+    n = con.execute("DELETE FROM tracking WHERE uid=?", (uid,)).rowcount
+    con.commit(); con.close()
+    with _cache_lock:
+        status_cache.pop(uid, None)
+    return n > 0
+
+# ---------- Status cache ----------
+# Card/danh sách đọc status từ cache; việc check Facebook chạy ở thread nền.
+# status_cache: uid -> (status 'live'|'die', checked_at)
+status_cache: dict[str, tuple[str, float]] = {}
+_cache_lock = threading.Lock()
+_refresh_wanted: set[str] = set()
+_refresh_event = threading.Event()
+
+def load_status_cache():
+    con = db()
+    rows = con.execute("SELECT uid, status, checked_at FROM tracking WHERE status IS NOT NULL").fetchall()
+    con.close()
+    with _cache_lock:
+        for uid, status, checked_at in rows:
+            status_cache[uid] = (status, checked_at or 0)
+
+def store_status(uid: str, status: str):
+    now = time.time()
+    with _cache_lock:
+        status_cache[uid] = (status, now)
+    con = db()
+    con.execute("UPDATE tracking SET status=?, checked_at=? WHERE uid=?", (status, int(now), uid))
+    con.commit(); con.close()
+
+def request_refresh(uids):
+    with _cache_lock:
+        _refresh_wanted.update(uids)
+    _refresh_event.set()
+
+def cached_status(uid: str) -> str:
+    """'live' | 'die' | 'unknown' (chưa có trong cache). Status cũ -> xin refresh nền."""
+    with _cache_lock:
+        hit = status_cache.get(uid)
+    if hit is None or time.time() - hit[1] > STATUS_TTL_SEC:
+        request_refresh([uid])
+    return hit[0] if hit else "unknown"
+
+def refresh_now(uids):
+    for uid, res in check_many(uids):
+        if res.status:  # check lỗi thì giữ status cũ
+            store_status(uid, res.status.lower())
+
+def stale_uids(limit: int = 500) -> list[str]:
+    con = db()
+    rows = con.execute("""
+        SELECT uid FROM tracking
+        WHERE following=1 AND (checked_at IS NULL OR checked_at < ?)
+        ORDER BY checked_at LIMIT ?
+    """, (int(time.time()) - STATUS_TTL_SEC, limit)).fetchall()
+    con.close()
+    return [r[0] for r in rows]
+
+def refresher():
+    while True:
+        _refresh_event.wait(timeout=REFRESH_INTERVAL_SEC)
+        _refresh_event.clear()
+        with _cache_lock:
+            wanted = set(_refresh_wanted)
+            _refresh_wanted.clear()
+        try:
+            refresh_now(wanted | set(stale_uids()))
+        except Exception as e:
+            print("Refresh lỗi:", e)
+
+# ---------- Cards ----------
+
 def build_card(uid: str, note: str = "unlock", customer: str = "T") -> tuple[str, InlineKeyboardMarkup]:
-    status = check_live(uid)
-    dot = GREEN if status == "live" else RED
+    status = cached_status(uid)
+    dot = GREEN if status == "live" else RED if status == "die" else PENDING
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     text = (
@@ -57,7 +173,7 @@ def build_card(uid: str, note: str = "unlock", customer: str = "T") -> tuple[str
 
     kb = InlineKeyboardMarkup(row_width=2)
     kb.add(InlineKeyboardButton("🌐 Mở Facebook", url=f"https://facebook.com/{uid}"))
-    following = tracking.get(uid, {}).get("following", True)
+    following = (get_tracked(uid) or {}).get("following", True)
     if following:
         kb.add(
             InlineKeyboardButton("🟢 Tiếp tục theo dõi", callback_data=f"noop:{uid}"),
@@ -104,11 +220,15 @@ def extract_uid_from_link(link: str, timeout: float = 10.0) -> str | None:
 
     return None
 
-def ensure_tracked(uid: str, note="unlock", customer="T"):
-    if uid not in tracking:
-        tracking[uid] = {"note": note, "customer": customer, "added": int(time.time()), "following": True}
-    else:
-        tracking[uid].update({"note": note or tracking[uid]["note"], "customer": customer or tracking[uid]["customer"]})
+def ensure_tracked(uid: str, note="unlock", customer="T") -> dict:
+    con = db()
+    con.execute("""
+        INSERT INTO tracking(uid, note, customer, added, following) VALUES(?,?,?,?,1)
+        ON CONFLICT(uid) DO UPDATE SET note=COALESCE(NULLIF(excluded.note,''), note),
+                                       customer=COALESCE(NULLIF(excluded.customer,''), customer)
+    """, (uid, note, customer, int(time.time())))
+    con.commit(); con.close()
+    return get_tracked(uid)
 
 # ---------- Command Handlers ----------
 
@@ -134,8 +254,10 @@ def cmd_them(m):
     note = parts[2] if len(parts) >= 3 else "unlock"
     customer = parts[3] if len(parts) >= 4 else "T"
 
-    ensure_tracked(uid, note, customer)
-    text, kb = build_card(uid, tracking[uid]["note"], tracking[uid]["customer"])
+    info = ensure_tracked(uid, note, customer)
+    if uid not in status_cache:
+        refresh_now([uid])  # UID mới: check 1 lần để card có status ngay
+    text, kb = build_card(uid, info["note"], info["customer"])
     bot.send_message(m.chat.id, text, reply_markup=kb, disable_web_page_preview=True)
 
 @bot.message_handler(commands=["themnhg"])
@@ -164,8 +286,13 @@ def cmd_themnhg(m):
         note = parts[1] if len(parts) >= 2 and parts[1] else "unlock"
         customer = parts[2] if len(parts) >= 3 and parts[2] else "T"
         ensure_tracked(uid, note, customer)
-        status = check_live(uid)
-        results.append({"uid": uid, "status": status, "note": note, "customer": customer})
+        results.append({"uid": uid, "status": "unknown", "note": note, "customer": customer})
+
+    # check cả lô song song thay vì từng UID một
+    for r, res in check_many(results, url_of=lambda r: profile_url(r["uid"])):
+        if res.status:
+            r["status"] = res.status.lower()
+            store_status(r["uid"], r["status"])
 
     # Tóm tắt + gửi từng card
     summary = "\n".join([f"{r['uid']}: {r['status']}" for r in results])
@@ -181,20 +308,21 @@ def cmd_xoa(m):
         bot.reply_to(m, "Cú pháp: <code>/xoa &lt;uid&gt;</code>")
         return
     uid = parts[1]
-    if tracking.pop(uid, None) is None:
+    if not untrack(uid):
         bot.reply_to(m, f"UID <code>{uid}</code> không tồn tại trong danh sách.")
     else:
         bot.reply_to(m, f"Đã xóa UID <code>{uid}</code> khỏi danh sách theo dõi.")
 
 @bot.message_handler(commands=["danhsach"])
 def cmd_danhsach(m):
-    if not tracking:
+    rows = list_tracked(50)
+    if not rows:
         bot.reply_to(m, "Danh sách trống.")
         return
     lines = []
-    for i, (uid, info) in enumerate(list(tracking.items())[:50], start=1):
-        status = check_live(uid)
-        dot = GREEN if status == "live" else RED
+    for i, (uid, info) in enumerate(rows, start=1):
+        status = cached_status(uid)
+        dot = GREEN if status == "live" else RED if status == "die" else PENDING
         lines.append(f"{i}. {uid} {dot} {status.upper()} | {info['note']} | {info['customer']}")
     text = "<b>UID đang theo dõi (tối đa 50):</b>\n" + "\n".join(lines)
     bot.reply_to(m, text)
@@ -223,18 +351,17 @@ def callbacks(c):
         bot.answer_callback_query(c.id); return
 
     if action == "stop":
-        if uid in tracking:
-            tracking[uid]["following"] = False
+        set_following(uid, False)
         bot.answer_callback_query(c.id, "Đã dừng theo dõi.")
     elif action == "start":
-        if uid in tracking:
-            tracking[uid]["following"] = True
+        set_following(uid, True)
         bot.answer_callback_query(c.id, "Đã tiếp tục theo dõi.")
     else:
         bot.answer_callback_query(c.id)
 
-    note = tracking.get(uid, {}).get("note", "unlock")
-    customer = tracking.get(uid, {}).get("customer", "T")
+    info = get_tracked(uid) or {}
+    note = info.get("note", "unlock")
+    customer = info.get("customer", "T")
     text, kb = build_card(uid, note, customer)
     try:
         bot.edit_message_text(chat_id=c.message.chat.id, message_id=c.message.message_id,
@@ -244,5 +371,7 @@ def callbacks(c):
 
 # ---------- Run ----------
 if __name__ == "__main__":
+    load_status_cache()
+    threading.Thread(target=refresher, daemon=True).start()
     print("Bot đang chạy…")
     bot.infinity_polling(skip_pending=True, timeout=60)
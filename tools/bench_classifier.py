@@ -0,0 +1,222 @@
+# tools/bench_classifier.py
+"""
+Replay corpus HTML đã gán nhãn qua classifier (fb_checker.classify_page) hoàn toàn offline.
+Báo cáo thời gian parse từng trang, throughput, bộ nhớ đỉnh, accuracy và confusion matrix.
+
+  python tools/bench_classifier.py run                       # chạy corpus mặc định
+  python tools/bench_classifier.py run --save base.json      # lưu kết quả làm baseline
+  python tools/bench_classifier.py run --baseline base.json  # exit 1 nếu chậm hơn / kém chính xác hơn
+  python tools/bench_classifier.py run --classifier mymod:classify   # thử parser/phrase mới
+  python tools/bench_classifier.py run --light [--limit 4096]   # probe nhẹ vs classify_page
+  python tools/bench_classifier.py record <url> --label DIE [--name ...] [--note ...]
+"""
+import os, sys, json, time, argparse, importlib, statistics, tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_CORPUS = os.path.join(ROOT, "tools", "corpus", "v1")
+LABELS = ("LIVE", "DIE", None)
+SLOWDOWN_TOLERANCE = 0.05  # cho phép chậm hơn baseline 5% (nhiễu đo)
+
+
+def load_classifier(spec: str | None):
+    if not spec:
+        from fb_checker import classify_page
+        return classify_page
+    mod, _, fn = spec.partition(":")
+    return getattr(importlib.import_module(mod), fn or "classify_page")
+
+def load_corpus(path: str):
+    with open(os.path.join(path, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    pages = []
+    for p in manifest["pages"]:
+        with open(os.path.join(path, p["file"]), encoding="utf-8") as f:
+            pages.append({**p, "text": f.read()})
+    return manifest, pages
+
+
+def light_classifier(kind: str, limit: int):
+    """
+    Mô phỏng probe nhẹ (fb_checker.probe_kind) trên trang đã lưu: cắt body như _light_fetch
+    (đọc từng chunk 8 KiB tới khi >= limit), gọi strategy.decide, mơ hồ -> fallback full page.
+    """
+    from fb_checker import PROBE_STRATEGIES, classify_page
+    strategy = PROBE_STRATEGIES[kind]
+    read_upto = -(-limit // 8192) * 8192
+
+    def cut(status_code, text):
+        if status_code in (404, 410):  # _light_fetch không đọc body
+            return "", True
+        raw = text.encode("utf-8")
+        if len(raw) < limit:
+            return text, True
+        return raw[:read_upto].decode("utf-8", errors="ignore"), False
+
+    def classify(status_code, text):
+        status, name = strategy.decide(status_code, *cut(status_code, text))
+        if status is None:
+            return classify_page(status_code, text)
+        return status, name
+
+    def decisive(status_code, text) -> bool:
+        return strategy.decide(status_code, *cut(status_code, text))[0] is not None
+
+    return classify, decisive
+
+
+def measure(classify, pages, repeat: int):
+    # warm-up (import bs4, cache regex, ...)
+    for p in pages:
+        classify(p["status_code"], p["text"])
+
+    rows, confusion = [], {str(e): {str(g): 0 for g in LABELS} for e in LABELS}
+    correct = name_ok = 0
+    total_time = total_bytes = 0.0
+    for p in pages:
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            got, name = classify(p["status_code"], p["text"])
+            times.append(time.perf_counter() - t0)
+        med = statistics.median(times)
+        size = len(p["text"].encode("utf-8"))
+        total_time += med
+        total_bytes += size
+        ok = got == p["label"]
+        correct += ok
+        name_ok += ok and name == p.get("name")
+        confusion[str(p["label"])][str(got)] += 1
+        rows.append({"file": p["file"], "bytes": size, "median_ms": med * 1000,
+                     "expected": p["label"], "got": got, "name": name, "ok": ok})
+
+    # bộ nhớ đo ở pass riêng để tracemalloc không làm sai số thời gian
+    tracemalloc.start()
+    for p in pages:
+        classify(p["status_code"], p["text"])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "pages": len(pages),
+        "accuracy": correct / len(pages),
+        "name_accuracy": name_ok / len(pages),
+        "pages_per_sec": len(pages) / total_time,
+        "mb_per_sec": total_bytes / total_time / 1e6,
+        "peak_mem_kb": peak / 1024,
+        "confusion": confusion,
+    }, rows
+
+
+def regressions(summary: dict, base: dict, what: str) -> list[str]:
+    failed = []
+    if summary["accuracy"] < base["accuracy"]:
+        failed.append(f"accuracy {summary['accuracy']:.1%} < {what} {base['accuracy']:.1%}")
+    if summary["name_accuracy"] < base["name_accuracy"]:
+        failed.append(f"name accuracy {summary['name_accuracy']:.1%} < {what} {base['name_accuracy']:.1%}")
+    if summary["pages_per_sec"] < base["pages_per_sec"] * (1 - SLOWDOWN_TOLERANCE):
+        failed.append(f"throughput {summary['pages_per_sec']:.0f} < {what} {base['pages_per_sec']:.0f} pages/s")
+    return failed
+
+
+def run(args):
+    manifest, pages = load_corpus(args.corpus)
+    if args.light:
+        if args.classifier:
+            raise SystemExit("--light và --classifier không dùng chung được")
+        from fb_checker import PROBE_BODY_LIMIT
+        limit = args.limit or PROBE_BODY_LIMIT
+        classify, decisive = light_classifier(args.light, limit)
+    else:
+        classify = load_classifier(args.classifier)
+    summary, rows = measure(classify, pages, args.repeat)
+    summary["corpus_version"] = manifest.get("version")
+
+    print(f"{'file':40} {'bytes':>8} {'ms':>8}  expected  got")
+    for r in rows:
+        mark = "" if r["ok"] else "  <-- MISS"
+        print(f"{r['file']:40} {r['bytes']:8d} {r['median_ms']:8.3f}  {r['expected']!s:8}  {r['got']!s}{mark}")
+    print()
+    print(f"corpus v{summary['corpus_version']}: {summary['pages']} pages, "
+          f"accuracy {summary['accuracy']:.1%}, name accuracy {summary['name_accuracy']:.1%}")
+    print(f"throughput {summary['pages_per_sec']:.0f} pages/s ({summary['mb_per_sec']:.2f} MB/s), "
+          f"peak mem {summary['peak_mem_kb']:.0f} KiB")
+    print("confusion (expected -> got):")
+    for e, gots in summary["confusion"].items():
+        print(f"  {e:5} " + "  ".join(f"{g}={n}" for g, n in gots.items()))
+
+    failed = []
+    if args.light:
+        # parser mới của probe nhẹ phải nhanh + chính xác ít nhất bằng classify_page trên trang đầy đủ
+        from fb_checker import classify_page
+        ref, _ = measure(classify_page, pages, args.repeat)
+        light = sum(decisive(p["status_code"], p["text"]) for p in pages)
+        summary["light_decided"] = light / len(pages)
+        print(f"light probe ({args.light}, limit {limit} B): decided {light}/{len(pages)} pages without fallback; "
+              f"classify_page: accuracy {ref['accuracy']:.1%}, {ref['pages_per_sec']:.0f} pages/s")
+        failed += regressions(summary, ref, "classify_page")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "pages": rows}, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            failed += regressions(summary, json.load(f)["summary"], "baseline")
+    if failed:
+        print("REGRESSION: " + "; ".join(failed))
+        return 1
+    if args.baseline or args.light:
+        print("OK: không chậm hơn và không kém chính xác hơn " + ("classify_page" if args.light else "baseline") + ".")
+    return 0
+
+
+def record(args):
+    import requests
+    from fb_checker import HEADERS
+    manifest_path = os.path.join(args.corpus, "manifest.json")
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    r = requests.get(args.url, headers=HEADERS, timeout=20, allow_redirects=True)
+    fn = args.file or f"rec_{args.label.lower()}_{int(time.time())}.html"
+    with open(os.path.join(args.corpus, fn), "w", encoding="utf-8") as f:
+        f.write(r.text)
+    manifest["pages"].append({"file": fn, "status_code": r.status_code, "label": args.label,
+                              "name": args.name, "note": args.note or f"recorded from {r.url}"})
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    print(f"Saved {fn} (HTTP {r.status_code}, {len(r.content)} bytes). Tăng 'version' nếu đổi nhãn trang cũ.")
+    return 0
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    r = sub.add_parser("run")
+    r.add_argument("--corpus", default=DEFAULT_CORPUS)
+    r.add_argument("--repeat", type=int, default=50)
+    r.add_argument("--classifier", help="module:function, mặc định fb_checker:classify_page")
+    r.add_argument("--light", nargs="?", const="profile", choices=["profile", "group"],
+                   help="đo probe nhẹ (body cắt ở PROBE_BODY_LIMIT + strategy.decide), gate với classify_page")
+    r.add_argument("--limit", type=int, help="ghi đè PROBE_BODY_LIMIT cho --light")
+    r.add_argument("--save")
+    r.add_argument("--baseline")
+    r.set_defaults(func=run)
+
+    rec = sub.add_parser("record")
+    rec.add_argument("url")
+    rec.add_argument("--label", required=True, choices=["LIVE", "DIE"])
+    rec.add_argument("--name")
+    rec.add_argument("--note")
+    rec.add_argument("--file")
+    rec.add_argument("--corpus", default=DEFAULT_CORPUS)
+    rec.set_defaults(func=record)
+
+    args = ap.parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+# tools/fake_bot_api.py
+"""
+Telegram Bot API giả chạy local (offline) cho load test.
+Mô phỏng rate limit của Telegram (toàn bot ~30 tin/s, mỗi chat ~1 tin/s) và trả 429
+kèm parameters.retry_after như thật; drop_rate cắt ngang kết nối của 1 phần sendMessage
+(lỗi mạng); ghi lại mọi tin đã nhận để đo độ trễ/số tin rớt.
+
+  python tools/fake_bot_api.py --port 8081
+  # bot: Application.builder().token("1:fake").base_url("http://127.0.0.1:8081/bot")
+"""
+import json, math, time, random, argparse, threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.at = burst, time.monotonic()
+
+    def take(self) -> float:
+        """0 nếu lấy được token, ngược lại số giây phải chờ."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.at) * self.rate)
+        self.at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class FakeBotAPI:
+    def __init__(self, port: int = 0, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 drop_rate: float = 0.0):
+        self.drop_rate = drop_rate
+        self.dropped = 0          # số request bị cắt kết nối
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate, self.chat_burst = chat_rate, chat_burst
+        self.chat_buckets: dict[int, TokenBucket] = {}
+        self.lock = threading.Lock()
+        self.deliveries = []      # (chat_id, monotonic, text)
+        self.calls = {}           # method -> số lần gọi
+        self.throttled = 0        # số lần trả 429
+        self.message_id = 0
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                api._handle(self)
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 1024  # backlog mặc định 5 làm fan-out lớn bị ConnectTimeout giả
+
+        self.server = Server(("127.0.0.1", port), Handler)
+        self.port = self.server.server_address[1]
+        self.base_url = f"http://127.0.0.1:{self.port}/bot"
+
+    # ---------- lifecycle ----------
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # ---------- request handling ----------
+    def _params(self, req) -> dict:
+        length = int(req.headers.get("Content-Length") or 0)
+        raw = req.rfile.read(length).decode("utf-8") if length else ""
+        ctype = req.headers.get("Content-Type", "")
+        if "json" in ctype:
+            return json.loads(raw or "{}")
+        params = {k: v[0] for k, v in parse_qs(raw).items()}
+        params.update({k: v[0] for k, v in parse_qs(urlparse(req.path).query).items()})
+        return params
+
+    def _reply(self, req, code: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        req.send_response(code)
+        req.send_header("Content-Type", "application/json")
+        req.send_header("Content-Length", str(len(body)))
+        req.end_headers()
+        req.wfile.write(body)
+
+    def _handle(self, req):
+        method = urlparse(req.path).path.rsplit("/", 1)[-1]
+        params = self._params(req)
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method == "getMe":
+            return self._reply(req, 200, {"ok": True, "result": {
+                "id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot",
+                "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}})
+        if method == "getUpdates":
+            time.sleep(min(float(params.get("timeout") or 0), 1))
+            return self._reply(req, 200, {"ok": True, "result": []})
+        if method in ("sendMessage", "editMessageText"):
+            if self.drop_rate and random.random() < self.drop_rate:
+                with self.lock:
+                    self.dropped += 1
+                req.close_connection = True  # đóng socket không trả lời
+                return
+            chat_id = int(params.get("chat_id") or 0)
+            with self.lock:
+                bucket = self.chat_buckets.setdefault(chat_id, TokenBucket(self.chat_rate, self.chat_burst))
+                wait = max(self.global_bucket.take(), bucket.take())
+                if wait:
+                    self.throttled += 1
+                else:
+                    self.message_id += 1
+                    self.deliveries.append((chat_id, time.monotonic(), params.get("text", "")))
+                    message_id = self.message_id
+            if wait:
+                retry_after = max(1, math.ceil(wait))
+                return self._reply(req, 429, {
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after}})
+            return self._reply(req, 200, {"ok": True, "result": {
+                "message_id": message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", "")}})
+        # setWebhook, deleteWebhook, answerCallbackQuery, editMessageReplyMarkup, ...
+        return self._reply(req, 200, {"ok": True, "result": True})
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--global-rate", type=float, default=30)
+    ap.add_argument("--chat-rate", type=float, default=1)
+    ap.add_argument("--drop-rate", type=float, default=0.0, help="tỉ lệ sendMessage bị cắt kết nối")
+    args = ap.parse_args()
+    api = FakeBotAPI(args.port, args.global_rate, args.chat_rate, drop_rate=args.drop_rate).start()
+    print(f"Fake Bot API at {api.base_url}<token>/<method>")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"delivered={len(api.deliveries)} throttled={api.throttled} dropped={api.dropped} calls={api.calls}")
+    except KeyboardInterrupt:
+        api.stop()
+
+if __name__ == "__main__":
+    main()
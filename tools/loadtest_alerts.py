@@ -0,0 +1,183 @@
+# tools/loadtest_alerts.py
+"""
+Load test fan-out alert hoàn toàn offline: bot thật (handler + poll_once + confirm lane)
+nói chuyện với tools/fake_bot_api.py thay vì Telegram, còn probe Facebook được thay bằng
+kết quả giả lập (một phần UID đổi LIVE -> DIE cùng lúc).
+
+  python tools/loadtest_alerts.py --chats 500 --uids 200 --subs-per-chat 2 --flip 1.0
+
+Báo cáo: tin/s, độ trễ giao alert p50/p90/p99/max, số tin rớt, số lần 429,
+thời gian event loop bị block, và thời gian xử lý /them, /danhsach.
+"""
+import os, re, sys, time, random, asyncio, logging, argparse, tempfile, threading, statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+TOKEN = "123456:loadtest"
+USER_ID = 4242
+UID_IN_TEXT = re.compile(r"\[(\w+)\]\(")
+
+
+def pct(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def seed(m, args, rnd):
+    uids = [str(10_000_000 + i) for i in range(args.uids)]
+    con = m.db()
+    con.executemany("INSERT INTO profiles(uid, url, last_status) VALUES(?, ?, 'LIVE')",
+                    [(u, f"https://mbasic.facebook.com/profile.php?id={u}") for u in uids])
+    subs = set()
+    for chat_id in range(1, args.chats + 1):
+        for u in rnd.sample(uids, min(args.subs_per_chat, len(uids))):
+            subs.add((chat_id, u))
+    con.executemany("INSERT INTO subscriptions(chat_id, uid, note, customer, kind) VALUES(?, ?, 'lt', 'KH', 'profile')",
+                    list(subs))
+    con.commit(); con.close()
+    m.grant_role(USER_ID, "user")
+    flipped = set(rnd.sample(uids, int(len(uids) * args.flip)))
+    expected = sum(1 for _, u in subs if u in flipped)
+    return uids, flipped, expected
+
+
+def patch_offline(m, flipped):
+    """Thay lớp probe Facebook bằng kết quả giả lập (không đụng mạng)."""
+    from fb_checker import CheckResult, CONFIRMED
+
+    def fake_check_many(items, url_of=None, max_workers=None, timeout=20, kind_of=None):
+        for item in items:
+            uid = item.uid if hasattr(item, "uid") else str(item)
+            yield item, CheckResult("DIE" if uid in flipped else "LIVE", None, 0)
+
+    async def fake_acheck_many(items, url_of=None, max_workers=None, timeout=20, kind_of=None):
+        for item, res in fake_check_many(items):
+            yield item, res
+
+    async def fake_afetch(url, timeout=20):
+        return "LIVE", None
+
+    m.check_many = fake_check_many
+    m.acheck_many = fake_acheck_many
+    m.afetch_status_and_name = fake_afetch
+    m.confirm_status = lambda *a, **k: (CONFIRMED, None)
+
+
+def command_update(app, chat_id: int, text: str, update_id: int):
+    from telegram import Update
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": int(time.time()), "text": text,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": USER_ID, "is_bot": False, "first_name": "Load"},
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+        },
+    }, app.bot)
+
+
+async def run(args):
+    from fake_bot_api import FakeBotAPI
+    from telegram.ext import Application
+    import tele_fb_monitor as m
+
+    rnd = random.Random(args.seed)
+    api = FakeBotAPI(0, args.global_rate, args.chat_rate, drop_rate=args.drop_rate).start()
+    uids, flipped, expected = seed(m, args, rnd)
+    patch_offline(m, flipped)
+
+    # thời điểm alert của từng UID được đẩy vào hàng gửi
+    enqueued = {}
+    notify = m.notify_change
+    def timed_notify(application, uid, *a, **k):
+        enqueued[uid] = time.monotonic()
+        return notify(application, uid, *a, **k)
+    m.notify_change = timed_notify
+
+    app = m.build_application(Application.builder().token(TOKEN).base_url(api.base_url).updater(None))
+
+    # đo event loop bị block: nhịp 5ms, trễ hơn dự kiến bao nhiêu
+    lags = []
+    async def heartbeat():
+        while True:
+            t = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append(time.perf_counter() - t - 0.005)
+
+    async with app:
+        app.bot_data["loop"] = asyncio.get_running_loop()
+        await app.start()
+        hb = asyncio.create_task(heartbeat())
+        for _ in range(max(1, m.CONFIRM_WORKERS)):
+            threading.Thread(target=m.confirm_worker, args=(app,), daemon=True).start()
+
+        # --- kịch bản 1: poll_once phát hiện hàng loạt UID đổi trạng thái ---
+        t0 = time.monotonic()
+        await asyncio.to_thread(m.poll_once, app)
+        poll_sec = time.monotonic() - t0
+        deadline = time.monotonic() + args.timeout
+        while len(api.deliveries) < expected and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        alert_deliveries = list(api.deliveries)
+        fanout_sec = (alert_deliveries[-1][1] - t0) if alert_deliveries else 0.0
+
+        # --- kịch bản 2: /them và /danhsach trong lúc hệ thống vừa fan-out ---
+        handler_times = {"/them": [], "/danhsach": []}
+        for i in range(args.commands):
+            chat_id = args.chats + 1 + i
+            for text in (f"/them {uids[i % len(uids)]} | lt | KH", "/danhsach"):
+                t = time.monotonic()
+                await app.process_update(command_update(app, chat_id, text, 10_000 + 2 * i + (text == "/danhsach")))
+                handler_times[text.split()[0]].append(time.monotonic() - t)
+
+        hb.cancel()
+        await app.stop()
+    api.stop()
+
+    latencies = []
+    for chat_id, at, text in alert_deliveries:
+        mt = UID_IN_TEXT.search(text)
+        if mt and mt.group(1) in enqueued:
+            latencies.append(at - enqueued[mt.group(1)])
+    blocked = [lag for lag in lags if lag > 0.02]
+
+    print(f"profiles={len(uids)} chats={args.chats} flipped={len(flipped)} expected alerts={expected}")
+    print(f"poll_once: {poll_sec:.2f}s; fan-out done in {fanout_sec:.2f}s")
+    print(f"delivered={len(alert_deliveries)} dropped={expected - len(alert_deliveries)} "
+          f"429s={api.throttled} network errors={api.dropped} rate={len(alert_deliveries) / fanout_sec if fanout_sec else 0:.1f} msg/s")
+    print("delivery latency: " + " ".join(f"p{p}={pct(latencies, p):.2f}s" for p in (50, 90, 99))
+          + f" max={max(latencies, default=float('nan')):.2f}s")
+    print(f"event loop: max lag {max(lags, default=0) * 1000:.1f}ms, "
+          f"{len(blocked)} stalls >20ms totalling {sum(blocked) * 1000:.0f}ms")
+    for cmd, ts in handler_times.items():
+        if ts:
+            print(f"{cmd}: n={len(ts)} median={statistics.median(ts) * 1000:.0f}ms max={max(ts) * 1000:.0f}ms")
+    return 0 if len(alert_deliveries) == expected else 1
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--chats", type=int, default=500)
+    ap.add_argument("--uids", type=int, default=200)
+    ap.add_argument("--subs-per-chat", type=int, default=2)
+    ap.add_argument("--flip", type=float, default=1.0, help="tỉ lệ UID đổi LIVE -> DIE")
+    ap.add_argument("--commands", type=int, default=5, help="số lượt /them + /danhsach")
+    ap.add_argument("--global-rate", type=float, default=30)
+    ap.add_argument("--chat-rate", type=float, default=1)
+    ap.add_argument("--drop-rate", type=float, default=0.0, help="tỉ lệ sendMessage bị cắt kết nối (lỗi mạng)")
+    ap.add_argument("--timeout", type=float, default=300)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    # DB tạm: tele_fb_monitor dùng DB_PATH tương đối
+    os.chdir(tempfile.mkdtemp(prefix="fbwatch-loadtest-"))
+    os.environ.setdefault("BOT_TOKEN", TOKEN)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    return asyncio.run(run(args))
+
+if __name__ == "__main__":
+    sys.exit(main())